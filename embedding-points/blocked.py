@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import numpy as np
+import argparse
+import os
+import time
+import embeddings
+
+"""
+Distance matrices that do not fit in memory.
+
+A distance matrix is computed one square block at a time and written to a .npy file, which is then opened as a memory map, so only the blocks that are in use are ever in memory. The coordinates may come from an array, or be streamed from a CSV file with one point per line, like random_coordinates.csv.
+
+The embedding functions below only ever read parts of such a matrix:
+
+- Gram computes products with the Gram matrix block by block, which is all the randomized eigensolver needs.
+- With landmarks, only the rows of the landmarks are read; by symmetry they hold the distances of all points to the landmarks.
+
+A landmark embedding can be saved and loaded again later (see embeddings.LandmarkEmbedding), to place new points into it using only their distances to the landmarks, without touching the matrix at all.
+"""
+
+def read_csv(path, output, chunk_size = 10**5):
+    """Stream the coordinates in a CSV file into a .npy file, chunk_size lines at a time, and return them as a memory map."""
+    with open(path, 'r') as f:
+        N = sum(1 for line in f if line.strip())
+    with open(path, 'r') as f:
+        first = next(line for line in f if line.strip())
+    d = len(first.split(','))
+    X = np.lib.format.open_memmap(output, mode = 'w+', dtype = np.float64, shape = (N, d))
+    with open(path, 'r') as f:
+        start = 0
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            if len(lines) == chunk_size:
+                X[start : start + len(lines)] = np.loadtxt(lines, delimiter = ',', ndmin = 2)
+                start += len(lines)
+                lines = []
+        if lines:
+            X[start : start + len(lines)] = np.loadtxt(lines, delimiter = ',', ndmin = 2)
+    X.flush()
+    return X
+
+def write_distance_matrix(X, path, block_size = 4096):
+    """
+    Compute the squared distances between the rows of X one block_size x block_size block at a time, and write them to the .npy file path. X may be an array, or the path of a CSV file, which gets streamed into path + '.coordinates.npy' first.
+    Returns the matrix as a read-only memory map.
+    """
+    if isinstance(X, str):
+        X = read_csv(X, path + '.coordinates.npy')
+    N = len(X)
+    D = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.float64, shape = (N, N))
+    for i in range(0, N, block_size):
+        rows = np.asarray(X[i : i + block_size])
+        D[i : i + block_size, i : i + block_size] = embeddings.to_distance_matrix(rows)
+        for j in range(i + block_size, N, block_size):
+            block = embeddings.to_distance_matrix(rows, np.asarray(X[j : j + block_size]))
+            D[i : i + block_size, j : j + block_size] = block
+            D[j : j + block_size, i : i + block_size] = block.T
+    D.flush()
+    del D
+    return open_distance_matrix(path)
+
+def open_distance_matrix(path):
+    """Open a distance matrix written by write_distance_matrix as a read-only memory map."""
+    return np.load(path, mmap_mode = 'r')
+
+class Gram():
+    """
+    The Gram matrix of a (memory-mapped) matrix D of squared distances, as in embeddings.gram_matrix, without ever building it: since B = -(D - r - r^T + t) / 2, where r holds the means of the rows of D and t their mean, products B @ Q only need products D @ Q, which are computed block_size rows at a time.
+    """
+
+    def __init__(self, D, block_size = 4096):
+        self.D = D
+        self.block_size = block_size
+        self.means = np.concatenate([np.asarray(D[i : i + block_size]).mean(axis = 1) for i in range(0, len(D), block_size)])
+
+    def __len__(self):
+        return len(self.D)
+
+    def __matmul__(self, Q):
+        DQ = np.concatenate([np.asarray(self.D[i : i + self.block_size]) @ Q for i in range(0, len(self.D), self.block_size)])
+        sums = Q.sum(axis = 0)
+        return -0.5 * (DQ - self.means[:, None] * sums[None, :] - (self.means @ Q)[None, :] + self.means.mean() * sums[None, :])
+
+def landmark_embedding(D, landmarks, output_dimension = 3, method = 'exact', rng = None):
+    """Choose the given number of landmarks among the points of the distance matrix D, and embed them. Only the rows of the landmarks are read."""
+    chosen = embeddings.choose_landmarks(len(D), landmarks, lambda i : np.asarray(D[i]), rng = rng)
+    between = np.array([D[i, chosen] for i in chosen])
+    return embeddings.LandmarkEmbedding(between, output_dimension, method = method, rng = rng, landmarks = chosen)
+
+def embed(D, output_dimension = 3, landmarks = None, method = 'randomized', block_size = 4096, seed = None):
+    """
+    Coordinates in R^d of the points with squared distances D, read block by block.
+    Without landmarks, the top eigenpairs of the Gram matrix are found with the randomized method, which reads the whole matrix a few times. With a number of landmarks, only their rows are read, and the method refers to the embedding of the landmarks.
+    """
+    rng = np.random.default_rng(seed)
+    if landmarks is None:
+        if method != 'randomized':
+            raise ValueError("Only the randomized method works without loading the whole matrix.")
+        values, vectors = embeddings.top_eigenpairs(Gram(D, block_size), output_dimension, method = method, rng = rng)
+        return vectors * np.sqrt(np.maximum(values, 0))
+    return place_all(landmark_embedding(D, landmarks, output_dimension, method = method, rng = rng), D, block_size)
+
+def place_all(embedding, D, block_size = 4096):
+    """Coordinates of all points of D in the given landmark embedding, reading block_size columns of the rows of the landmarks at a time."""
+    Y = np.zeros((len(D), embedding.coordinates.shape[1]))
+    for start in range(0, len(D), block_size):
+        Y[start : start + block_size] = embedding.place(np.asarray(D[embedding.landmarks, start : start + block_size]).T)
+    return Y
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compute the distance matrix of the points in a CSV file block by block, and embed them in R^3 without loading the matrix.")
+    parser.add_argument('input', help = "CSV file with one point per line")
+    parser.add_argument('matrix', help = ".npy file for the distance matrix; reused if it exists")
+    parser.add_argument('--landmarks', type = int, default = None)
+    parser.add_argument('--block-size', type = int, default = 4096)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = None, help = ".npy file for the coordinates")
+    parser.add_argument('--save', default = None, help = ".npz file for the landmark embedding, to place new points into later")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    D = open_distance_matrix(args.matrix) if os.path.exists(args.matrix) else write_distance_matrix(args.input, args.matrix, block_size = args.block_size)
+    print("Distance matrix of %d points ready after %.2f s." %(len(D), time.perf_counter() - start))
+    if args.save is not None and args.landmarks is not None:
+        embedding = landmark_embedding(D, args.landmarks, rng = np.random.default_rng(args.seed))
+        embedding.save(args.save)
+        Y = place_all(embedding, D, args.block_size)
+    else:
+        Y = embed(D, landmarks = args.landmarks, method = 'exact' if args.landmarks is not None else 'randomized', block_size = args.block_size, seed = args.seed)
+    print("Embedded after %.2f s." %(time.perf_counter() - start))
+    if args.output is not None:
+        np.save(args.output, Y)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import math
+import numpy as np
+import argparse
+import time
+
+"""
+Finding coordinates in R^d for points of which we only know the mutual distances, as in the notebook, but for hundreds of thousands of points.
+
+- All matrices are built with array operations instead of Python loops.
+- Only the top d eigenvalues and eigenvectors of the Gram matrix are computed, either exactly or with a randomized method that only needs a few products with the matrix.
+- With landmarks, only a few hundred or thousand points are embedded this way (classical scaling). The other points are placed using only their distances to the landmarks, which is the Nyström method; the full N x N distance matrix is never built.
+
+As in the notebook, distance matrices hold squared distances. Coordinates can only be recovered up to translation, rotation and reflection; here the points are centred around the origin, rather than putting the last point there.
+"""
+
+def to_distance_matrix(X, Y = None):
+    """Squared Euclidean distances between the rows of the N x d matrix X and those of the M x d matrix Y (by default X itself), as an N x M matrix."""
+    if Y is None:
+        Y = X
+    D = -2 * (X @ Y.T)
+    D += (X**2).sum(axis = 1)[:, None]
+    D += (Y**2).sum(axis = 1)[None, :]
+    np.maximum(D, 0, out = D) #Rounding errors can make distances between nearby points slightly negative
+    if Y is X:
+        np.fill_diagonal(D, 0)
+    return D
+
+def gram_matrix(D):
+    """The matrix of dot products x_i · x_j of points centred around the origin with squared distances D, found by double centering: -(J D J) / 2 with J = I - 1/N."""
+    means = D.mean(axis = 0)
+    B = D - means[:, None]
+    B -= means[None, :]
+    B += means.mean()
+    B *= -0.5
+    return B
+
+def top_eigenpairs(B, k, method = 'exact', oversampling = 10, power_iterations = 4, rng = None):
+    """
+    The k largest eigenvalues of the symmetric matrix B, in decreasing order, with their eigenvectors as columns.
+    The 'randomized' method finds them within a random subspace of dimension k + oversampling that is pushed towards the top eigenvectors by a few power iterations; it is exact up to rounding when B has rank at most k + oversampling. It only needs products B @ Q, so B may be anything that provides those and len(B), such as blocked.Gram.
+    """
+    if method == 'exact' or k + oversampling >= len(B):
+        if not isinstance(B, np.ndarray):
+            B = B @ np.eye(len(B))
+        values, vectors = np.linalg.eigh(B)
+    elif method == 'randomized':
+        if rng is None:
+            rng = np.random.default_rng()
+        Q = np.linalg.qr(B @ rng.standard_normal((len(B), k + oversampling)))[0]
+        for _ in range(power_iterations):
+            Q = np.linalg.qr(B @ Q)[0]
+        values, vectors = np.linalg.eigh(Q.T @ (B @ Q))
+        vectors = Q @ vectors
+    else:
+        raise ValueError("Unknown method '%s'." %method)
+    order = np.argsort(values)[::-1][: k]
+    return values[order], vectors[:, order]
+
+def to_coordinate_matrix(D, output_dimension = 3, method = 'exact', rng = None):
+    """Convert an N x N matrix of squared distances into an N x d matrix of coordinates, using the top d eigenpairs of the Gram matrix. Negative eigenvalues, which occur if the distances cannot be realised in any Euclidean space, are treated as zero."""
+    values, vectors = top_eigenpairs(gram_matrix(D), output_dimension, method = method, rng = rng)
+    return vectors * np.sqrt(np.maximum(values, 0))
+
+def choose_landmarks(N, m, distances_to, method = 'maxmin', rng = None):
+    """
+    Indices of m out of N points to use as landmarks, where distances_to(i) gives the squared distances of all points to point i. With 'maxmin', every next landmark is the point farthest away from the landmarks so far, which spreads them out evenly over the data; with 'random' they are drawn at random.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    m = min(m, N)
+    if method == 'random':
+        return np.sort(rng.choice(N, m, replace = False))
+    if method != 'maxmin':
+        raise ValueError("Unknown method '%s'." %method)
+    landmarks = np.zeros(m, dtype = np.int64)
+    landmarks[0] = rng.integers(N)
+    nearest = np.array(distances_to(landmarks[0]), dtype = np.float64) #Squared distance to the nearest landmark so far
+    for i in range(1, m):
+        landmarks[i] = np.argmax(nearest)
+        np.minimum(nearest, distances_to(landmarks[i]), out = nearest)
+    return landmarks
+
+class LandmarkEmbedding():
+    """
+    An embedding of a set of landmarks by classical scaling, which places any other point using only its squared distances to the landmarks (Nyström, or landmark MDS):
+
+        y = -L (delta - mean) / 2,
+
+    where delta holds the squared distances of the point to the landmarks, mean holds the average squared distance of every landmark to the others, and the rows of L are the top eigenvectors of the Gram matrix of the landmarks divided by the square roots of their eigenvalues. A landmark itself lands exactly on its own coordinates. Once saved, an embedding can be loaded again to place new points into it, as long as their distances to the landmarks are known.
+    """
+
+    def __init__(self, between, output_dimension = 3, method = 'exact', rng = None, landmarks = None):
+        """Embed the landmarks, given the m x m matrix of their squared distances. The indices of the landmarks among the original points may be stored along with the embedding."""
+        self.landmarks = landmarks
+        values, vectors = top_eigenpairs(gram_matrix(between), output_dimension, method = method, rng = rng)
+        values = np.maximum(values, 0)
+        self.coordinates = vectors * np.sqrt(values)
+        scale = np.divide(1, np.sqrt(values), out = np.zeros_like(values), where = values > 0) #Directions without any spread get no coordinate
+        self.projection = (vectors * scale).T
+        self.mean = between.mean(axis = 0)
+        self.values = values
+
+    def place(self, to_landmarks):
+        """Coordinates of points with the given squared distances to the landmarks, one row per point."""
+        return -0.5 * (to_landmarks - self.mean) @ self.projection.T
+
+    def save(self, path):
+        """Write the embedding to an .npz file; it can be restored with load()."""
+        np.savez(path, coordinates = self.coordinates, projection = self.projection, mean = self.mean, values = self.values, landmarks = self.landmarks if self.landmarks is not None else np.zeros(0, dtype = np.int64))
+
+def load(path):
+    """Restore a landmark embedding written by LandmarkEmbedding.save()."""
+    embedding = LandmarkEmbedding.__new__(LandmarkEmbedding)
+    with np.load(path) as data:
+        for name in ['coordinates', 'projection', 'mean', 'values', 'landmarks']:
+            setattr(embedding, name, np.array(data[name]))
+    if len(embedding.landmarks) == 0:
+        embedding.landmarks = None
+    return embedding
+
+def landmark_embedding(X, landmarks, output_dimension = 3, method = 'exact', rng = None):
+    """Choose the given number of landmarks among the rows of X, and embed them."""
+    chosen = choose_landmarks(len(X), landmarks, lambda i : to_distance_matrix(X, X[i : i + 1])[:, 0], rng = rng)
+    return LandmarkEmbedding(to_distance_matrix(X[chosen]), output_dimension, method = method, rng = rng, landmarks = chosen)
+
+def embed(X, output_dimension = 3, landmarks = None, method = 'exact', batch_size = 10**4, seed = None):
+    """
+    Coordinates in R^d of the points whose coordinates in some other space are the rows of X, as close to isometric as possible.
+    Without landmarks, the full distance matrix is used. With a number of landmarks, only the distances to those are needed, computed batch_size points at a time to keep the memory use down.
+    """
+    rng = np.random.default_rng(seed)
+    if landmarks is None:
+        return to_coordinate_matrix(to_distance_matrix(X), output_dimension, method = method, rng = rng)
+    embedding = landmark_embedding(X, landmarks, output_dimension, method = method, rng = rng)
+    Y = np.zeros((len(X), output_dimension))
+    for start in range(0, len(X), batch_size):
+        Y[start : start + batch_size] = embedding.place(to_distance_matrix(X[start : start + batch_size], X[embedding.landmarks]))
+    return Y
+
+def distortion(X, Y, pairs = 10**6, seed = 0):
+    """Relative error in the squared distances of Y compared to those of X, over all pairs of points if there are at most that many, and over a random sample of pairs otherwise."""
+    N = len(X)
+    if N * (N - 1) // 2 <= pairs:
+        i, j = np.triu_indices(N, 1)
+    else:
+        rng = np.random.default_rng(seed)
+        i, j = rng.integers(N, size = pairs), rng.integers(N, size = pairs)
+    original = ((X[i] - X[j])**2).sum(axis = 1)
+    embedded = ((Y[i] - Y[j])**2).sum(axis = 1)
+    return np.linalg.norm(embedded - original) / np.linalg.norm(original)
+
+def align(Y, reference):
+    """Y moved, rotated and possibly reflected to lie as close as possible to the reference (orthogonal Procrustes)."""
+    centred = Y - Y.mean(axis = 0)
+    U, _, VT = np.linalg.svd(centred.T @ (reference - reference.mean(axis = 0)))
+    return centred @ U @ VT + reference.mean(axis = 0)
+
+def error_report(X, output_dimension = 3, landmarks = (50, 100, 200, 400), seed = 0):
+    """
+    Compare the faster methods with the exact one on a small set of points. For every method, report how long it took, the distortion of the squared distances, and the root mean square distance of its points to the exact embedding after aligning the two, relative to the root mean square size of the exact embedding.
+    """
+    results = []
+    exact = None
+    for name, method, m in [('exact', 'exact', None), ('randomized', 'randomized', None)] + [('landmarks %d' %m, 'exact', m) for m in landmarks]:
+        start = time.perf_counter()
+        Y = embed(X, output_dimension, landmarks = m, method = method, seed = seed)
+        seconds = time.perf_counter() - start
+        if exact is None:
+            exact = Y
+        size = np.sqrt(((exact - exact.mean(axis = 0))**2).sum(axis = 1).mean())
+        difference = np.sqrt(((align(Y, exact) - exact)**2).sum(axis = 1).mean()) / size
+        results.append({'method' : name, 'seconds' : seconds, 'distortion' : distortion(X, Y), 'difference' : difference})
+        print("%-16s %8.3f s   distortion %.4f   difference from exact %.2e" %(name, seconds, results[-1]['distortion'], difference))
+    return results
+
+def klein_bottle(N, a = 3, b = 2):
+    """
+    About N points on the Klein bottle in R^4 from the notebook (a > b > 0), on a square grid of parameters.
+    Returns the parameters (x, y), which are useful for colouring, and the coordinates in R^4.
+    """
+    n = math.floor(math.sqrt(N))
+    x, y = np.meshgrid(np.linspace(0, 2 * np.pi, n), np.linspace(0, 2 * np.pi, n))
+    x, y = x.flatten(), y.flatten()
+    coordinates = np.array([(b * np.cos(y) + a) * np.cos(x), (b * np.cos(y) + a) * np.sin(x), b * np.sin(y) * np.cos(x / 2), b * np.sin(y) * np.sin(y / 2)]).T
+    return np.array([x, y]).T, coordinates
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Embed points sampled from the Klein bottle in R^4 into R^3 as isometrically as possible.")
+    parser.add_argument('points', type = int, nargs = '?', default = 3600)
+    parser.add_argument('--landmarks', type = int, default = None, help = "number of landmarks; all points are used if not given")
+    parser.add_argument('--method', choices = ['exact', 'randomized'], default = 'exact')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = None, help = "image file for a plot of the embedding")
+    parser.add_argument('--report', action = 'store_true', help = "compare the methods with the exact one instead")
+    args = parser.parse_args()
+    parameters, X = klein_bottle(args.points)
+    if args.report:
+        error_report(X, seed = args.seed)
+    else:
+        start = time.perf_counter()
+        Y = embed(X, landmarks = args.landmarks, method = args.method, seed = args.seed)
+        print("Embedded %d points in %.2f s; distortion %.4f." %(len(X), time.perf_counter() - start, distortion(X, Y)))
+        if args.output is not None:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize = (10, 10))
+            ax = plt.axes(projection = '3d')
+            ax.scatter(Y[:, 0], Y[:, 1], Y[:, 2], c = parameters[:, 0], cmap = 'hsv', s = 1)
+            plt.savefig(args.output)
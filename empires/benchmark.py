@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+import numpy as np
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import field
+import perlin
+import tiled
+from history import HistoryWriter, HistoryReader
+from population import PopulationWriter, PopulationReader, Window
+from render import Renderer, FFmpegWriter
+
+"""
+Measures how fast the parts of the program are, with fixed seeds so that every run does the same work:
+
+- terrain generation, per (size, granularity);
+- Field.iterate, per size, on a map and on a blank field, with the time spent in every phase of an iteration (see field.Profile);
+- drawing and encoding frames.
+
+Results are written to a JSON file, along with the version of the code and the machine they were measured on, so that runs can be compared with --compare to spot regressions.
+With --check, a few consistency checks run instead, which make sure that the faster ways of doing things give the same results as the straightforward ones.
+"""
+
+def environment():
+	"""Where and on what the benchmark ran."""
+	try:
+		revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		revision = None
+	return {'revision' : revision, 'time' : time.strftime('%Y-%m-%d %H:%M:%S'), 'python' : platform.python_version(), 'numpy' : np.__version__,
+		'machine' : platform.machine(), 'system' : platform.system(), 'cpus' : os.cpu_count()}
+
+def benchmark_terrain(sizes, granularities, seed = 0):
+	"""Seconds it takes to generate a map, bypassing the cache."""
+	results = []
+	for size in sizes:
+		for granularity in granularities:
+			start = time.perf_counter()
+			perlin.terrain(size = size, granularity = granularity, seed = seed, cache = False)
+			results.append({'size' : size, 'granularity' : granularity, 'seconds' : time.perf_counter() - start})
+			print("Terrain %d/%d: %.2f s" %(size, granularity, results[-1]['seconds']))
+	return results
+
+def make_field(size, real_mode, seed = 0, workers = None):
+	"""The field the benchmarks run on: sizes of 4 and up use the tiled engine."""
+	with contextlib.redirect_stdout(io.StringIO()):
+		if size >= 4:
+			return tiled.TiledField(real_mode = real_mode, size = size, granularity = 2, spawn_rate = 3, strength = 2, seed = seed, recycle_ids = True, workers = workers)
+		return field.Field(real_mode = real_mode, size = size, granularity = 2, spawn_rate = 3, strength = 2, seed = seed, engine = 'numpy', recycle_ids = True)
+
+def benchmark_iterate(size, real_mode, iterations = 200, warmup = 200, seed = 0, workers = None):
+	"""
+	Iterations per second, and frontier blocks probed per second, once the field has filled up a bit during the warmup iterations.
+	Also reports the time spent per phase over the measured iterations.
+	"""
+	input_field = make_field(size, real_mode, seed = seed, workers = workers)
+	for _ in range(warmup):
+		input_field.iterate()
+	input_field.profile = field.Profile()
+	start = time.perf_counter()
+	for _ in range(iterations):
+		input_field.iterate()
+	seconds = time.perf_counter() - start
+	if isinstance(input_field, tiled.TiledField):
+		input_field.close()
+	summary = input_field.profile.summary()
+	result = {'size' : size, 'real_mode' : real_mode, 'iterations' : iterations, 'warmup' : warmup, 'seconds' : seconds,
+		'steps_per_second' : iterations / seconds, 'cells_per_second' : summary['probed'] / seconds, 'updated_per_second' : summary['updated'] / seconds,
+		'phases' : {phase : summary[phase] for phase in field.Profile.phases}}
+	print("Iterate %d/%s: %.1f steps/s, %.0f cells/s" %(size, 'map' if real_mode else 'blank', result['steps_per_second'], result['cells_per_second']))
+	return result
+
+def benchmark_render(frames = 60, size = 1, width = 1920, height = 960, codec = 'libx265', preset = 'medium', seed = 0):
+	"""Frames per second for drawing alone, and for drawing and encoding together, on a short recorded simulation."""
+	input_field = make_field(size, True, seed = seed)
+	with tempfile.TemporaryDirectory() as path:
+		with HistoryWriter(path, input_field) as history_writer, PopulationWriter(path, input_field) as population_writer:
+			for _ in range(frames):
+				input_field.iterate()
+				history_writer.append(input_field, [[int(n), t, input_field.empires.name(n), input_field.empires.hex_colour(n)] for n, t in input_field.messages])
+				population_writer.append(input_field)
+		history_reader = HistoryReader(path)
+		population_reader = PopulationReader(path)
+
+		start = time.perf_counter()
+		for image in Renderer(history_reader, population_reader, width = width, height = height).frames():
+			pass
+		draw = frames / (time.perf_counter() - start)
+
+		encode = None
+		if shutil.which('ffmpeg') is not None:
+			start = time.perf_counter()
+			with FFmpegWriter(os.path.join(path, 'benchmark.mp4'), width, height, codec = codec, preset = preset) as writer:
+				for image in Renderer(history_reader, population_reader, width = width, height = height).frames():
+					writer.write(image)
+			encode = frames / (time.perf_counter() - start)
+	print("Render %dx%d: %.1f frames/s drawing, %s frames/s with encoding" %(width, height, draw, "%.1f" %encode if encode is not None else "n/a"))
+	return {'frames' : frames, 'size' : size, 'width' : width, 'height' : height, 'codec' : codec, 'preset' : preset, 'draw_fps' : draw, 'encode_fps' : encode}
+
+def record(input_field, path, iterations, history_writer = None, population_writer = None, checkpoint = None):
+	"""
+	Let the field run up to the given number of iterations and record them the way simulate() does, saving a checkpoint to the given file every 500 iterations.
+	The writers are opened on path if they are not given, and are closed afterwards.
+	"""
+	history_writer = history_writer or HistoryWriter(path, input_field)
+	population_writer = population_writer or PopulationWriter(path, input_field)
+	with history_writer, population_writer:
+		advance(input_field, iterations, history_writer, population_writer, checkpoint)
+
+def advance(input_field, iterations, history_writer, population_writer, checkpoint = None):
+	"""Let the field run up to the given number of iterations, recording them; see record()."""
+	while input_field.time < iterations:
+		input_field.iterate()
+		history_writer.append(input_field, [[int(n), t, input_field.empires.name(n), input_field.empires.hex_colour(n)] for n, t in input_field.messages])
+		population_writer.append(input_field)
+		if checkpoint is not None and input_field.time % 500 == 0:
+			history_writer.flush()
+			population_writer.flush()
+			input_field.save(checkpoint)
+
+def check_resume(size = 1, real_mode = True, crash = 1450, iterations = 2000, seed = 0):
+	"""
+	Interrupt a recorded run some time after its last checkpoint, resume it from there, and check that the history comes out exactly the same as that of a run that was never interrupted.
+	Returns the names of the files that differ.
+	"""
+	with tempfile.TemporaryDirectory() as path:
+		clean, interrupted, checkpoint = os.path.join(path, 'clean'), os.path.join(path, 'interrupted'), os.path.join(path, 'checkpoint.npz')
+		record(make_field(size, real_mode, seed = seed), clean, iterations)
+
+		input_field = make_field(size, real_mode, seed = seed)
+		history_writer, population_writer = HistoryWriter(interrupted, input_field), PopulationWriter(interrupted, input_field)
+		advance(input_field, crash, history_writer, population_writer, checkpoint)
+		#The crash: files get cut off wherever their buffers happened to be written out. Here everything made it to disk except events.idx, which gets only 8 bytes per step, so its buffer is written out less often than that of events.jsonl.
+		history_writer.flush()
+		population_writer.flush()
+		with open(os.path.join(interrupted, 'events.idx'), 'r+b') as f:
+			f.truncate(crash // 500 * 500 * 8)
+
+		input_field = field.load(checkpoint)
+		record(input_field, interrupted, iterations, HistoryWriter(interrupted, input_field, resume = True), PopulationWriter(interrupted, input_field, resume = True))
+		differences = []
+		for name in sorted(os.listdir(clean)):
+			with open(os.path.join(clean, name), 'rb') as f, open(os.path.join(interrupted, name), 'rb') as g:
+				if f.read() != g.read():
+					differences.append(name)
+	print("Resume %d/%s after a crash at %d: %s" %(size, 'map' if real_mode else 'blank', crash, "differs in " + ", ".join(differences) if differences else "identical"))
+	return differences
+
+def check_frontier(size = 1, real_mode = True, iterations = 600, interval = 50, seed = 0):
+	"""Check every interval iterations that the frontier, which is kept up to date around the blocks that changed, is the same as the frontier rebuilt from scratch."""
+	input_field = make_field(size, real_mode, seed = seed)
+	passed = True
+	while input_field.time < iterations:
+		input_field.iterate()
+		if input_field.time % interval == 0:
+			frontier = [set(part) for part in input_field.frontier]
+			input_field.rebuild_frontier()
+			passed &= frontier == input_field.frontier
+	print("Frontier %d/%s: %s" %(size, 'map' if real_mode else 'blank', "identical" if passed else "differs"))
+	return passed
+
+def check_history(size = 1, real_mode = True, iterations = 1200, seed = 0):
+	"""
+	Record a run and check that the ways of reading it back agree: frames from the nearest keyframe with frames played forward one step at a time, and the population window of every step with the one kept up to date by Window.
+	"""
+	input_field = make_field(size, real_mode, seed = seed)
+	with tempfile.TemporaryDirectory() as path:
+		record(input_field, path, iterations)
+		history_reader = HistoryReader(path)
+		population_reader = PopulationReader(path)
+		passed = all(np.array_equal(frame, history_reader.frame(step)) for step, frame in enumerate(history_reader.frames()))
+		passed &= np.array_equal(history_reader.frame(iterations), input_field.inhabitants)
+		window = Window(100, [population_reader.row(0)])
+		for step in range(1, iterations + 1):
+			window.update(*population_reader.deltas(step))
+			serials, counts = window.window()
+			expected_serials, expected_counts = population_reader.window(step, 100)
+			passed &= np.array_equal(serials, expected_serials) and np.array_equal(counts, expected_counts)
+	print("History %d/%s: %s" %(size, 'map' if real_mode else 'blank', "identical" if passed else "differs"))
+	return passed
+
+def check():
+	"""Run all consistency checks, and return whether they passed."""
+	passed = True
+	for size, real_mode in [(1, True), (0, False)]: #The second run has an empire that gets founded and collapses in the same step before the checkpoint
+		passed &= check_frontier(size, real_mode)
+		passed &= check_history(size, real_mode)
+		passed &= not check_resume(size, real_mode)
+	return passed
+
+def compare(old, new):
+	"""Print how the throughput changed between two benchmark results; above 1 means faster."""
+	print("Comparing %s with %s:" %(old['environment']['revision'], new['environment']['revision']))
+	for key, speed in [('terrain', lambda result : 1 / result['seconds']), ('iterate', lambda result : result['steps_per_second'])]:
+		previous = {tuple(value for name, value in result.items() if name in ['size', 'granularity', 'real_mode']) : speed(result) for result in old.get(key, [])}
+		for result in new.get(key, []):
+			case = tuple(value for name, value in result.items() if name in ['size', 'granularity', 'real_mode'])
+			if case in previous:
+				print("%s %s: %.2fx" %(key, case, speed(result) / previous[case]))
+	for name in ['draw_fps', 'encode_fps']:
+		if old.get('render', {}).get(name) and new.get('render', {}).get(name):
+			print("render %s: %.2fx" %(name, new['render'][name] / old['render'][name]))
+
+def run(sizes = (0, 1, 2), iterations = 200, warmup = 200, frames = 60, workers = None):
+	"""Run the whole suite and return the results."""
+	results = {'environment' : environment()}
+	results['terrain'] = benchmark_terrain(sizes, range(4))
+	results['iterate'] = [benchmark_iterate(size, real_mode, iterations = iterations, warmup = warmup, workers = workers) for size in sizes for real_mode in [True, False]]
+	results['render'] = benchmark_render(frames = frames)
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Measure the speed of terrain generation, iterations and rendering.")
+	parser.add_argument('output', nargs = '?', default = 'benchmark.json', help = "JSON file to write the results to")
+	parser.add_argument('--sizes', type = int, nargs = '+', choices = range(7), default = [0, 1, 2])
+	parser.add_argument('--iterations', type = int, default = 200)
+	parser.add_argument('--warmup', type = int, default = 200)
+	parser.add_argument('--frames', type = int, default = 60)
+	parser.add_argument('--workers', type = int, default = None, help = "worker processes for sizes of 4 and up; all cores by default")
+	parser.add_argument('--compare', default = None, help = "earlier results to compare with")
+	parser.add_argument('--check', action = 'store_true', help = "run the consistency checks instead")
+	args = parser.parse_args()
+	if args.check:
+		raise SystemExit(0 if check() else 1)
+	results = run(sizes = args.sizes, iterations = args.iterations, warmup = args.warmup, frames = args.frames, workers = args.workers)
+	with open(args.output, 'w') as f:
+		json.dump(results, f, indent = 1)
+	if args.compare is not None:
+		with open(args.compare, 'r') as f:
+			compare(json.load(f), results)
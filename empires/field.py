@@ -1,52 +1,233 @@
 import perlin
-import random
 import numpy as np
-from itertools import product
+from bisect import bisect
+from itertools import accumulate
 import csv
+import json
+import os
+import time
 
 slow_factor = 2 #Global term slowing down the simulation; used in simulation.py as well
 
 with open('language.txt', 'r', encoding = 'CP437') as f:
 	names = [row[0] for row in csv.reader(f, delimiter = '\n')] #We will be sampling from these names whenever an empire gets created
 
-class Empire():
-	"""Captures all attributes of a specific empire."""
+def grow(array, capacity):
+	"""Return a copy of the array with room for at least the given number of rows; capacity at least doubles so that appending stays cheap."""
+	old_capacity = len(array)
+	if capacity <= old_capacity:
+		return array
+	new = np.zeros((max(capacity, 2 * old_capacity),) + array.shape[1 :], dtype = array.dtype)
+	new[: old_capacity] = array
+	return new
 
-	def __init__(self, strength = 2, count = 0, empty = False):
+def draw(flat, index, offsets, strength, habitability, r):
+	"""
+	Decide on the new inhabitants of the given blocks of the flattened field: every block picks one of the blocks in its neighbourhood (given by offsets), with probability proportional to the strength of its inhabitant, times the habitability of the block on a map.
+	The uniform numbers r, one per block, make the choices; the weighted draw is done the same way as random.choices, by bisecting against the cumulative weights.
+	"""
+	surroundings = flat[index[None, :] + offsets[:, None]] #Shape (9, blocks); row 0 is the block itself
+	prob = strength[surroundings]
+	if habitability is not None:
+		prob = np.where(surroundings == 0, 1, prob * habitability[index])
+	cumulative = np.cumsum(prob, axis = 0)
+	choice = np.minimum((cumulative <= r * cumulative[-1]).sum(axis = 0), 8)
+	return surroundings[choice, np.arange(len(index))]
+
+def frontier_changes(flat, partition, changed, offsets, start = 0, stop = None):
+	"""
+	Given the flat indices of blocks whose inhabitants changed, find the blocks that may have joined or left the frontier: their flat indices, the part of the partition they belong to, and whether their neighbourhood is mixed.
+	Only blocks with indices in [start, stop) are considered.
+	"""
+	affected = np.sort((changed[:, None] + offsets[None, :]).reshape(-1)) #Only these blocks can have gained or lost a uniform neighbourhood
+	affected = affected[np.concatenate(([True], affected[1:] != affected[:-1]))] if len(affected) > 0 else affected
+	affected = affected[(affected >= start) & (affected < (stop if stop is not None else len(flat)))]
+	part = partition[affected]
+	affected = affected[part >= 0]
+	part = part[part >= 0]
+	surroundings = flat[affected[None, :] + offsets[:, None]]
+	mixed = (surroundings != surroundings[0]).any(axis = 0)
+	return affected, part, mixed
+
+class Profile():
+	"""Records how long every phase of Field.iterate takes, and how many blocks get probed and updated, iteration by iteration."""
+
+	phases = ['sample', 'spawn', 'update', 'bookkeeping', 'nerf']
+
+	def __init__(self):
 		"""Initialise attributes."""
-		self.count = count
-		self.empty = empty
-		
+		self.times = {phase : [] for phase in self.phases} #Seconds spent per iteration
+		self.probed = [] #Frontier blocks sampled per iteration
+		self.updated = [] #Blocks that changed hands per iteration
+		self.last = 0
+
+	def start(self):
+		self.last = time.perf_counter()
+
+	def lap(self, phase):
+		now = time.perf_counter()
+		self.times[phase].append(now - self.last)
+		self.last = now
+
+	def count(self, probed, updated):
+		self.probed.append(probed)
+		self.updated.append(updated)
+
+	def summary(self):
+		"""Total time per phase, and totals of the block counts."""
+		summary = {phase : float(np.sum(self.times[phase])) for phase in self.phases}
+		summary['iterations'] = len(self.probed)
+		summary['probed'] = int(np.sum(self.probed))
+		summary['updated'] = int(np.sum(self.updated))
+		return summary
+
+class EmpireArchive():
+	"""Compact log of the empires that have perished: name, lifespan and peak size, in order of death."""
+
+	def __init__(self, capacity = 64):
+		"""Initialise attributes."""
+		self.length = 0
+		self.serial = np.zeros(capacity, dtype = np.int64)
+		self.birth = np.zeros(capacity, dtype = np.int64)
+		self.death = np.zeros(capacity, dtype = np.int64)
+		self.peak = np.zeros(capacity, dtype = np.int64)
+		self.names = []
+
+	def __len__(self):
+		return self.length
+
+	def record(self, serial, names, birth, death, peak):
+		"""Append the given empires to the log."""
+		start = self.length
+		self.length += len(serial)
+		for attribute, values in [('serial', serial), ('birth', birth), ('death', death), ('peak', peak)]:
+			array = grow(getattr(self, attribute), self.length)
+			array[start : self.length] = values
+			setattr(self, attribute, array)
+		self.names.extend(names)
+
+	def lifespan(self):
+		return self.death[: self.length] - self.birth[: self.length]
+
+class EmpireTable():
+	"""Captures the attributes of all empires. Every attribute is stored as an array indexed by the empire's number, so that operations on all living empires are array operations."""
+
+	def __init__(self, capacity = 64, recycle = False, rng = None):
+		"""Initialise attributes."""
+		self.rng = rng if rng is not None else np.random.default_rng() #Colours, names and nerfs are drawn from this
+		self.length = 0 #Number of empire numbers handed out so far
+		self.recycle = recycle #If set, the numbers of dead empires are handed out again, which keeps all arrays (and the playing field's dtype) small
+		self.free = [] #Numbers of dead empires that may be reused
+		self.founded = 0 #Number of empires founded so far
+		self.serial = np.zeros(capacity, dtype = np.int64) #Running number of the empire among all empires ever founded; unlike its number, this is never reused
+		self.strength = np.zeros(capacity) #Strength is used when determining with what probability blocks take on a certain value
+		self.decrease = np.zeros(capacity) #How much the strength changes when the empire gets nerfed
+		self.count = np.zeros(capacity, dtype = np.int64)
+		self.peak = np.zeros(capacity, dtype = np.int64)
+		self.birth = np.zeros(capacity, dtype = np.int64)
+		self.age = np.zeros(capacity, dtype = np.int64)
+		self.alive = np.zeros(capacity, dtype = bool)
+		self.colour = np.zeros((capacity, 3), dtype = np.uint8)
+		self.names = []
+		self.living = np.zeros(0, dtype = np.int64) #Indices of living empires, in order of birth
+		self.archive = EmpireArchive()
+
+	def __len__(self):
+		return self.length
+
+	def dtype(self):
+		"""Smallest unsigned integer type that can hold the number of every empire in the table."""
+		return np.min_scalar_type(len(self.strength) - 1)
+
+	def reserve(self, capacity):
+		"""Make sure that the arrays can hold at least the given number of empires."""
+		for attribute in ['serial', 'strength', 'decrease', 'count', 'peak', 'birth', 'age', 'alive', 'colour']:
+			setattr(self, attribute, grow(getattr(self, attribute), capacity))
+
+	def add(self, strength = 2, count = 0, empty = False, time = 0):
+		"""Register a new empire and return its number."""
+		if self.free:
+			n = self.free.pop()
+		else:
+			n = self.length
+			self.reserve(n + 1)
+			self.length += 1
+			self.names.append(None)
+		self.serial[n] = self.founded
+		self.founded += 1
+		self.count[n] = count
+		self.peak[n] = count
+		self.birth[n] = time
+		self.age[n] = 0
+
 		if not empty:
 			#Attach a colour to the mpire; to ensure brightness, the colour hex value isn't picked arbitrarily
 			rgb = [0, 0, 0] #initial rgb
-			main, secondary = random.sample([0, 1, 2], 2)
+			main, secondary = self.rng.choice(3, 2, replace = False)
 			rgb[main] = 255
-			secondary_value = random.choice(range(255))
+			secondary_value = self.rng.integers(255)
 			rgb[secondary] = secondary_value
-			self.colour = "#%02X%02X%02X" %(rgb[0], rgb[1], rgb[2])
+			self.colour[n] = rgb
+
+			self.strength[n] = 2.5 + 0.25 * strength
+			self.decrease[n] = 0.01 * (4 - strength) / slow_factor
+			self.alive[n] = True
+			self.living = np.append(self.living, n)
+		else: #We treat an empty field as an empire as well, though it behaves differently; it is black, and never lives or dies
+			self.colour[n] = [0, 0, 0]
+			self.strength[n] = 1
+			self.decrease[n] = 0
+			self.alive[n] = False
 
-			self.strength = 2.5 + 0.25 * strength #Strength is used when determining with what probability blocks take on a certain value
-			self.decrease = 0.01 * (4 - strength) / slow_factor
-		else: #We treat an empty field as an empire as well, though it behaves differently
-			self.colour = "black"
-			self.strength = 1
-		
 		#Give empire a name
-		name1 = random.choice(names)
-		name2 = random.choice(names)
-		self.name = (name1 + name2).capitalize()
-		self.age = 0
-	
+		name1 = names[self.rng.integers(len(names))]
+		name2 = names[self.rng.integers(len(names))]
+		self.names[n] = (name1 + name2).capitalize()
+		return n
+
+	def name(self, n):
+		return self.names[n]
+
+	def hex_colour(self, n):
+		"""Colour of empire n in a format Matplotlib understands."""
+		return "#%02X%02X%02X" %tuple(self.colour[n])
+
+	def bury(self, time = 0):
+		"""Register the deaths of living empires without any inhabitants left, and return their numbers. Their data moves to the archive."""
+		dead = self.count[self.living] == 0
+		deaths = self.living[dead]
+		self.alive[deaths] = False
+		self.living = self.living[~dead]
+		if len(deaths) > 0:
+			self.archive.record(self.serial[deaths], [self.names[n] for n in deaths], self.birth[deaths], time, self.peak[deaths])
+			if self.recycle:
+				self.free.extend(deaths.tolist())
+		return deaths
+
+	def update_peaks(self):
+		self.peak[self.living] = np.maximum(self.peak[self.living], self.count[self.living])
+
+	def grow_older(self, milestone):
+		"""Increase the age of all living empires, and return the ones that just reached the milestone age."""
+		self.age[self.living] += 1
+		return self.living[self.age[self.living] == milestone]
+
+	def larger_than(self, size):
+		"""Return the living empires whose population exceeds the given size."""
+		return self.living[self.count[self.living] > size]
+
 	def nerf(self):
-		if not self.empty and self.strength > 1:
-			factor = random.choice([-1, -1, 1]) #There's some randomness involved in the nerf function, just to make the development a bit more interesting
-			self.strength += factor * self.decrease
+		"""Randomly change the strength of all living empires."""
+		nerfed = self.living[self.strength[self.living] > 1]
+		factor = np.where(self.rng.random(len(nerfed)) < 2/3, -1, 1) #There's some randomness involved in the nerf function, just to make the development a bit more interesting
+		self.strength[nerfed] += factor * self.decrease[nerfed]
 
 class Field():
 	"""The playing field for our Game of Life."""
 
-	def __init__(self, real_mode = True, size = 1, granularity = 2, spawn_rate = 1, strength = 2):
+	tiled = False #Whether the iterations are spread over worker processes; see tiled.py
+
+	def __init__(self, real_mode = True, size = 1, granularity = 2, spawn_rate = 1, strength = 2, seed = None, engine = 'python', recycle_ids = False):
 		"""Initialise attributes."""
 		#Initiate some parameters
 		print("Initialising field...")
@@ -55,33 +236,43 @@ class Field():
 		self.spawn_rate = 2**(4 - spawn_rate) * slow_factor
 		self.strength = strength
 		self.real_mode = real_mode
+		self.engine = engine #Either 'python' (cell by cell) or 'numpy' (whole partition at once)
+		#All randomness of the simulation comes from this generator, so that a seed determines the whole run. Without a seed we pick one, which can be looked up afterwards to repeat the run.
+		self.seed = seed if seed is not None else int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+		self.rng = np.random.default_rng(np.random.SeedSequence(self.seed).spawn(1)[0]) #Independent of the generator making the map
 		self.time = 0
 		self.milestone = 125 * 2**self.size_param * slow_factor #If an empire reaches this age, it qualifies as impressive
 
 		#Initiate map if set to real mode
 		if self.real_mode:
-			self.heights = perlin.grid(size = self.size_param, granularity = granularity)
-			self.habitability = np.zeros((self.size, self.size))
-			for x in range(self.size):
-				for y in range(self.size):
-					self.habitability[x, y] = -abs(2 * self.heights[x, y] - 1) + 1
-			self.habitable_blocks = [x for x in product(range(1, self.size - 1), repeat = 2) if self.habitability[x] > 0] #This is all we need to iterate over when updating the playing field.
-			self.spawnable_blocks = [x for x in product(range(3, self.size - 3), repeat = 2) if self.habitability[x] > 0.3] #Where a new empire might spawn.
+			self.heights, self.habitability, habitable, spawnable = perlin.terrain(size = self.size_param, granularity = granularity, seed = self.seed, cache = seed is not None) #Maps of random seeds are not worth keeping
+			self.habitable_blocks = np.argwhere(habitable) #This is all we need to iterate over when updating the playing field; one row of coordinates per block.
+			self.spawnable_blocks = np.argwhere(spawnable) #Where a new empire might spawn.
 		else:
-			self.habitable_blocks = [x for x in product(range(1, self.size - 1), repeat = 2)]
+			interior = np.zeros((self.size, self.size), dtype = bool)
+			interior[1 : self.size - 1, 1 : self.size - 1] = True
+			self.habitable_blocks = np.argwhere(interior)
 			self.spawnable_blocks = self.habitable_blocks
 
 		#We partition the habitable blocks into pieces which get sampled separately during each timeframe. We do this to slow down the development of the animation.
-		random.shuffle(self.habitable_blocks)
-		self.partition = [self.habitable_blocks[i :: slow_factor] for i in range(slow_factor)]
+		self.rng.shuffle(self.habitable_blocks)
+		self.partition = np.full((self.size, self.size), -1, dtype = np.int8) #Which part a block belongs to; -1 if it never gets updated
+		for i in range(slow_factor):
+			self.partition[tuple(self.habitable_blocks[i :: slow_factor].T)] = i
+
+		#Only blocks on the border between two empires can change hands, so per part we keep track of those (as flat indices) and ignore all others.
+		self.frontier = [set() for _ in range(slow_factor)]
+		self.frontier_size = 0 #Number of blocks probed during the last iteration
 
 		#Declare attributes related to the playing field
-		self.empires = [Empire(count = self.size**2, empty = True)] #Holds all empire data.
-		self.living = [] #Collection of indices of living empires.
-		self.inhabitants = np.zeros((self.size, self.size), dtype = int) #Keeps track of who lives on a given square
+		self.empires = EmpireTable(recycle = recycle_ids, rng = self.rng) #Holds all empire data.
+		self.empires.add(count = self.size**2, empty = True)
+		self.inhabitants = np.zeros((self.size, self.size), dtype = self.empires.dtype()) #Keeps track of who lives on a given square; the dtype is widened whenever the empire table outgrows it
 		
-		self.update = {} #Reset the update dictionary.
+		self.update_index = np.zeros(0, dtype = np.int64) #Flat indices of the blocks that changed hands during the last iteration
+		self.update_owner = np.zeros(0, dtype = self.inhabitants.dtype) #Their new inhabitants
 		self.messages = [] #Reset the messages
+		self.profile = None #Set to a Profile to time the phases of every iteration
 
 	def neighbourhood(self, x):
 		"""Given a point x in our grid, return the points around it that we consider a 'neighbourhood' of the point."""
@@ -90,70 +281,208 @@ class Field():
 		return [(x0, y0),
 				(x0 - 1, y0 - 1), (x0 + 1, y0 - 1), (x0 - 1, y0 + 1), (x0 + 1, y0 + 1),
 				(x0 - 1, y0), (x0, y0 - 1), (x0, y0 + 1), (x0 + 1, y0)]
+
+	def neighbourhood_offsets(self):
+		"""The neighbourhood of a block, in the same order as above, but as offsets with respect to the flattened grid."""
+		s = self.size
+		return np.array([0, -s - 1, s - 1, -s + 1, s + 1, -s, -1, 1, s], dtype = np.int64)
 	
+	def refresh_frontier(self, changed):
+		"""Given the flat indices of blocks whose inhabitants changed, update the frontier around them."""
+		affected, part, mixed = frontier_changes(self.inhabitants.reshape(-1), self.partition.reshape(-1), changed, self.neighbourhood_offsets())
+		for i in range(slow_factor):
+			in_part = part == i
+			self.frontier[i].update(affected[in_part & mixed].tolist())
+			self.frontier[i].difference_update(affected[in_part & ~mixed].tolist())
+
+	def rebuild_frontier(self):
+		"""Recompute the frontier from scratch."""
+		self.frontier = [set() for _ in range(slow_factor)]
+		self.refresh_frontier(np.flatnonzero(self.partition >= 0))
+
 	def spawn(self, x):
 		"""Introduce new empire around coordinate x."""
-		n = len(self.empires)
-		new_empire = Empire(strength = self.strength) #Fill in stuff.
-		self.empires.append(new_empire)
-		self.living.append(n)
-		for y in self.neighbourhood(x):
-			self.inhabitants[y] = n
-			new_empire.count += 1
+		n = self.empires.add(strength = self.strength, time = self.time) #Fill in stuff.
+		if np.dtype(self.empires.dtype()).itemsize > self.inhabitants.dtype.itemsize:
+			self.inhabitants = self.inhabitants.astype(self.empires.dtype())
+		cells = x[0] * self.size + x[1] + self.neighbourhood_offsets()
+		flat = self.inhabitants.reshape(-1)
+		np.subtract.at(self.empires.count, flat[cells], 1)
+		flat[cells] = n
+		self.empires.count[n] += len(cells)
+		self.refresh_frontier(cells)
 		self.messages.append([n, 1]) #[n, 1] means message of type 1 concerning empire n
 
 	def survival_rate(self, n, x):
 		if n == 0:
 			return 1
 		elif not self.real_mode:
-			return self.empires[n].strength #Case distinction is somewhat irrelevant but it slightly speeds up the real_mode=False simulation
+			return self.empires.strength[n] #Case distinction is somewhat irrelevant but it slightly speeds up the real_mode=False simulation
 		else:
-			return self.empires[n].strength * self.habitability[x]
+			return self.empires.strength[n] * self.habitability[x]
+
+	def sample_python(self, part):
+		"""Decide on the new inhabitant of every frontier block in the given part of the partition, one block at a time."""
+		update = {}
+		for i in sorted(self.frontier[part]): #Blocks whose neighbourhood is uniform are not in the frontier, so they are ignored. The order is fixed so that the same random numbers go to the same blocks every time.
+			x = divmod(i, self.size)
+			surroundings = [self.inhabitants[n] for n in self.neighbourhood(x)]
+			cumulative = list(accumulate(self.survival_rate(n, x) for n in surroundings))
+			update[i] = surroundings[min(bisect(cumulative, self.rng.random() * cumulative[-1]), 8)] #Same as random.choices, but drawing from the field's generator
+		index = np.fromiter(update.keys(), dtype = np.int64, count = len(update))
+		owner = np.fromiter(update.values(), dtype = self.inhabitants.dtype, count = len(update))
+		return index, owner
+
+	def sample_numpy(self, part):
+		"""Same as sample_python, but all frontier blocks of the part are handled at once using array operations."""
+		index = np.sort(np.fromiter(self.frontier[part], dtype = np.int64, count = len(self.frontier[part]))) #Same order as sample_python
+		owner = draw(self.inhabitants.reshape(-1), index, self.neighbourhood_offsets(), self.empires.strength, self.habitability.reshape(-1) if self.real_mode else None, self.rng.random(len(index)))
+		return index, owner
 
 	def iterate(self):
 		"""Simulate the passage of time and every bit of misery that comes with it."""
-		self.update = {} #Reset the update dictionary.
 		self.messages = [] #Reset the messages
 		self.time += 1
+		if self.profile is not None:
+			self.profile.start()
 
 		#Procedure will be slightly different depending on whether we're using a map or not.
-		for x in self.partition[self.time % slow_factor]: #Only probe part of the field
-			surroundings = [self.inhabitants[n] for n in self.neighbourhood(x)]
-			if len(set(surroundings)) == 1: #Optimisation procedure --- ignores blocks whose neighbourhood is uniform.
-				continue
-			else:
-				prob = [self.survival_rate(n, x) for n in surroundings]
-				self.update[x] = random.choices(surroundings, weights = prob, k = 1)[0] #Appears to be significantly faster than numpy's weighted random choice
+		part = self.time % slow_factor #Only probe part of the field
+		self.frontier_size = len(self.frontier[part])
+		if self.engine == 'numpy':
+			index, owner = self.sample_numpy(part)
+		else:
+			index, owner = self.sample_python(part)
+		self.lap('sample')
 
-		#New empire?
-		p = random.choice(range(self.spawn_rate)) #Only with some minor probability will we introduce a new empire
-		if p == 0:
-			x = random.choice(self.spawnable_blocks)
-			self.spawn(x)
+		touched, before = self.new_empire(index)
+		self.lap('spawn')
 
 		#Finally, invoke the updates.
-		for x in self.update:
-			self.empires[self.inhabitants[x]].count -= 1
-			self.inhabitants[x] = self.update[x]
-			self.empires[self.inhabitants[x]].count += 1
+		flat = self.inhabitants.reshape(-1) #Taken only now, since spawning may have widened the dtype
+		old = flat[index]
+		flat[index] = owner
+		np.subtract.at(self.empires.count, old, 1)
+		np.add.at(self.empires.count, owner, 1)
+		after = flat[touched]
+		changed = after != before
+		self.update_index = touched[changed]
+		self.update_owner = after[changed]
+		self.refresh_frontier(index[owner != old])
+		self.lap('update')
+
+		self.bookkeeping()
+		self.lap('bookkeeping')
 
+		#Implement nerf.
+		self.empires.nerf()
+		self.lap('nerf')
+		if self.profile is not None:
+			self.profile.count(self.frontier_size, len(self.update_index))
+
+	def lap(self, phase):
+		"""If profiling, note that the given phase of the iteration just finished."""
+		if self.profile is not None:
+			self.profile.lap(phase)
+
+	def new_empire(self, index):
+		"""
+		Maybe introduce a new empire, in between sampling the given blocks and updating them.
+		Returns the blocks touched during this iteration (the sampled ones and those of the new empire) along with their inhabitants beforehand.
+		"""
+		touched = index
+		p = self.rng.integers(self.spawn_rate) #Only with some minor probability will we introduce a new empire
+		if p == 0:
+			x = self.spawnable_blocks[self.rng.integers(len(self.spawnable_blocks))]
+			touched = np.unique(np.concatenate((index, x[0] * self.size + x[1] + self.neighbourhood_offsets())))
+		before = self.inhabitants.reshape(-1)[touched]
+		if p == 0:
+			self.spawn(x)
+		return touched, before
+
+	def bookkeeping(self):
+		"""Everything that happens to the empires after the field has been updated: deaths, ageing and milestones."""
 		#Register deaths.
-		for n in self.living[:]:
-			if self.empires[n].count == 0:
-				self.living.remove(n)
-				self.messages.append([n, 0]) #[n, 0] means message of type 0 concerning empire n
+		self.empires.update_peaks()
+		for n in self.empires.bury(self.time):
+			self.messages.append([n, 0]) #[n, 0] means message of type 0 concerning empire n
 
 		#Update age.
-		for n in self.living:
-			self.empires[n].age += 1
-			if self.empires[n].age == self.milestone:
-				self.messages.append([n, 2])
+		for n in self.empires.grow_older(self.milestone):
+			self.messages.append([n, 2])
 
-		size_milestone  = (self.size**2 - self.empires[0].count) / 3
-		for n in self.living:
-			if self.empires[n].count > size_milestone:
-				self.messages.append([n, 3])
+		size_milestone  = (self.size**2 - self.empires.count[0]) / 3
+		for n in self.empires.larger_than(size_milestone):
+			self.messages.append([n, 3])
 
-		#Implement nerf.
-		for n in self.living:
-			self.empires[n].nerf()
+	def save(self, path):
+		"""
+		Write a checkpoint of the field to path, from which load() restores it exactly: continuing the restored field gives the same results as continuing this one.
+		Arrays are stored as they are in an uncompressed .npz file; everything else goes into a JSON header inside it.
+		"""
+		empires = self.empires
+		archive = empires.archive
+		meta = {'tiled' : self.tiled, 'real_mode' : self.real_mode, 'size_param' : self.size_param, 'spawn_rate' : self.spawn_rate, 'strength' : self.strength, 'seed' : self.seed, 'engine' : self.engine,
+			'time' : self.time, 'milestone' : self.milestone, 'frontier_size' : self.frontier_size, 'messages' : [[int(n), t] for n, t in self.messages],
+			'rng' : self.rng.bit_generator.state,
+			'empires' : {'capacity' : len(empires.strength), 'length' : empires.length, 'recycle' : empires.recycle, 'free' : empires.free, 'founded' : empires.founded, 'names' : empires.names},
+			'archive' : {'length' : archive.length, 'names' : archive.names}}
+		arrays = {'inhabitants' : self.inhabitants, 'partition' : self.partition, 'update_index' : self.update_index, 'update_owner' : self.update_owner,
+			'habitable_blocks' : self.habitable_blocks, 'spawnable_blocks' : self.spawnable_blocks}
+		if self.real_mode:
+			arrays['heights'] = self.heights
+			arrays['habitability'] = self.habitability
+		for i in range(slow_factor):
+			arrays['frontier_%d' %i] = np.sort(np.fromiter(self.frontier[i], dtype = np.int64, count = len(self.frontier[i])))
+		for attribute in empire_attributes:
+			arrays['empires_' + attribute] = getattr(empires, attribute)[: empires.length]
+		for attribute in archive_attributes:
+			arrays['archive_' + attribute] = getattr(archive, attribute)[: archive.length]
+
+		temp_path = path + '.%d.tmp' %os.getpid() #Write to a temporary file first so that a crash while saving leaves the previous checkpoint intact
+		with open(temp_path, 'wb') as f:
+			np.savez(f, meta = np.array(json.dumps(meta)), **arrays)
+		os.replace(temp_path, path)
+
+empire_attributes = ['serial', 'strength', 'decrease', 'count', 'peak', 'birth', 'age', 'alive', 'colour', 'living']
+archive_attributes = ['serial', 'birth', 'death', 'peak']
+
+def meta(path):
+	"""The settings and counters stored in a checkpoint, without loading the field itself."""
+	with np.load(path) as data:
+		return json.loads(str(data['meta']))
+
+def load(path):
+	"""Restore a field from a checkpoint written by Field.save()."""
+	with np.load(path) as data:
+		meta = json.loads(str(data['meta']))
+		input_field = Field.__new__(Field)
+		for attribute in ['real_mode', 'size_param', 'spawn_rate', 'strength', 'seed', 'engine', 'time', 'milestone', 'frontier_size', 'messages']:
+			setattr(input_field, attribute, meta[attribute])
+		input_field.size = 128 * 2**input_field.size_param
+		input_field.profile = None
+		input_field.rng = np.random.default_rng()
+		input_field.rng.bit_generator.state = meta['rng']
+		for attribute in ['inhabitants', 'partition', 'update_index', 'update_owner']:
+			setattr(input_field, attribute, data[attribute])
+		input_field.habitable_blocks = data['habitable_blocks']
+		input_field.spawnable_blocks = data['spawnable_blocks'] if input_field.real_mode else input_field.habitable_blocks #On a blank field, these are one and the same array
+		if input_field.real_mode:
+			input_field.heights = data['heights']
+			input_field.habitability = data['habitability']
+		input_field.frontier = [set(data['frontier_%d' %i].tolist()) for i in range(slow_factor)]
+
+		empires = EmpireTable(capacity = meta['empires']['capacity'], recycle = meta['empires']['recycle'], rng = input_field.rng)
+		for attribute in ['length', 'free', 'founded', 'names']:
+			setattr(empires, attribute, meta['empires'][attribute])
+		for attribute in empire_attributes:
+			if attribute == 'living':
+				empires.living = data['empires_living']
+			else:
+				getattr(empires, attribute)[: empires.length] = data['empires_' + attribute]
+		for attribute in ['length', 'names']:
+			setattr(empires.archive, attribute, meta['archive'][attribute])
+		for attribute in archive_attributes:
+			setattr(empires.archive, attribute, grow(data['archive_' + attribute], 64))
+		input_field.empires = empires
+	return input_field
@@ -0,0 +1,206 @@
+import numpy as np
+import json
+import os
+
+"""
+The history of a simulation is stored in a directory containing the following files.
+
+- meta.json       Parameters of the field, the names and colours of the empires alive on the first frame, and (once the writer is closed) the number of steps and the largest empire number used.
+- heights.npy     The map, if the simulation ran in real mode.
+- keyframes.bin   Full copies of the playing field, one every keyframe_interval steps (starting with step 0).
+- cells.bin       Flat indices of the blocks that changed hands, for all steps one after another.
+- owners.bin      The new inhabitants of those blocks.
+- offsets.bin     For every step, the number of entries in cells.bin and owners.bin up to and including that step.
+- events.jsonl    One line per step, holding that step's messages as [number, type, name, colour].
+- events.idx      Byte offset of every line in events.jsonl.
+
+Step 0 is the field before the first iteration; step t is the field after t iterations. All binary files are raw arrays which we read back through memory maps, so neither writing nor reading needs to hold more than a single frame in memory.
+"""
+
+index_dtype = np.uint32 #Enough for fields of up to 65536 x 65536 blocks
+owner_dtype = np.uint32
+
+class HistoryWriter():
+	"""Records a simulation step by step."""
+
+	def __init__(self, path, input_field, keyframe_interval = 500, resume = False):
+		"""
+		Create the history directory and record the current state of the field as step 0.
+		With resume set, the field has been restored from a checkpoint instead, and we carry on with the existing history, throwing away whatever got recorded after the checkpoint.
+		"""
+		self.path = path
+		self.size = input_field.size
+		self.keyframe_interval = keyframe_interval
+		self.steps = 0
+		self.entries = 0 #Number of entries written to cells.bin and owners.bin so far
+		self.event_bytes = 0
+		self.numbers = len(input_field.empires) #Largest empire number used so far, plus one
+		if resume:
+			self.resume(input_field)
+			return
+		os.makedirs(path, exist_ok = True)
+
+		self.meta = {'size' : self.size, 'real_mode' : input_field.real_mode, 'milestone' : input_field.milestone, 'keyframe_interval' : keyframe_interval,
+			'names' : [input_field.empires.name(n) for n in range(len(input_field.empires))],
+			'colours' : [input_field.empires.hex_colour(n) for n in range(len(input_field.empires))]}
+		self.write_meta()
+		if input_field.real_mode:
+			np.save(os.path.join(path, 'heights.npy'), input_field.heights)
+
+		self.keyframes = open(os.path.join(path, 'keyframes.bin'), 'wb')
+		self.cells = open(os.path.join(path, 'cells.bin'), 'wb')
+		self.owners = open(os.path.join(path, 'owners.bin'), 'wb')
+		self.offsets = open(os.path.join(path, 'offsets.bin'), 'wb')
+		self.events = open(os.path.join(path, 'events.jsonl'), 'wb')
+		self.event_index = open(os.path.join(path, 'events.idx'), 'wb')
+		self.offsets.write(np.zeros(1, dtype = np.int64).tobytes())
+		self.keyframes.write(input_field.inhabitants.astype(owner_dtype).tobytes())
+
+	def resume(self, input_field):
+		"""Cut all files off at the step the field is at, and reopen them for appending."""
+		with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+			self.meta = json.load(f)
+		self.meta.pop('steps', None)
+		self.meta.pop('numbers', None)
+		self.keyframe_interval = self.meta['keyframe_interval']
+		self.steps = input_field.time
+		#The last step may have been written only partially, so we read no further than the checkpoint.
+		offsets = np.fromfile(os.path.join(self.path, 'offsets.bin'), dtype = np.int64, count = self.steps + 1)
+		event_index = np.fromfile(os.path.join(self.path, 'events.idx'), dtype = np.int64, count = self.steps)
+		if len(offsets) < self.steps + 1 or len(event_index) < self.steps:
+			raise ValueError("The history at %s does not go up to step %d, where the checkpoint is." %(self.path, self.steps))
+		self.entries = int(offsets[self.steps])
+		if self.steps > 0: #events.jsonl may already hold lines of later steps, even when events.idx does not, so we cut it off after the line of the checkpoint step
+			with open(os.path.join(self.path, 'events.jsonl'), 'rb') as f:
+				f.seek(int(event_index[-1]))
+				line = f.readline()
+			if not line.endswith(b'\n'):
+				raise ValueError("The history at %s does not go up to step %d, where the checkpoint is." %(self.path, self.steps))
+			self.event_bytes = int(event_index[-1]) + len(line)
+		if self.entries > 0:
+			self.numbers = max(self.numbers, int(np.fromfile(os.path.join(self.path, 'owners.bin'), dtype = owner_dtype, count = self.entries).max()) + 1)
+		keyframe_bytes = (self.steps // self.keyframe_interval + 1) * self.size**2 * np.dtype(owner_dtype).itemsize
+
+		sizes = {'keyframes.bin' : keyframe_bytes, 'cells.bin' : self.entries * np.dtype(index_dtype).itemsize, 'owners.bin' : self.entries * np.dtype(owner_dtype).itemsize,
+			'offsets.bin' : (self.steps + 1) * 8, 'events.jsonl' : self.event_bytes, 'events.idx' : self.steps * 8}
+		files = {}
+		for name, size in sizes.items():
+			files[name] = open(os.path.join(self.path, name), 'r+b')
+			files[name].truncate(size)
+			files[name].seek(size)
+		self.keyframes, self.cells, self.owners, self.offsets, self.events, self.event_index = [files[name] for name in sizes]
+		self.write_meta()
+
+	def append(self, input_field, messages = None):
+		"""Record the iteration the field just went through. The messages default to the field's own, as [number, type]."""
+		self.steps += 1
+		self.cells.write(input_field.update_index.astype(index_dtype).tobytes())
+		self.owners.write(input_field.update_owner.astype(owner_dtype).tobytes())
+		self.entries += len(input_field.update_index)
+		if len(input_field.update_owner) > 0:
+			self.numbers = max(self.numbers, int(input_field.update_owner.max()) + 1)
+		self.offsets.write(np.array([self.entries], dtype = np.int64).tobytes())
+
+		if messages is None:
+			messages = [[int(n), t] for n, t in input_field.messages]
+		line = (json.dumps(messages) + '\n').encode()
+		self.event_index.write(np.array([self.event_bytes], dtype = np.int64).tobytes())
+		self.events.write(line)
+		self.event_bytes += len(line)
+
+		if self.steps % self.keyframe_interval == 0:
+			self.keyframes.write(input_field.inhabitants.astype(owner_dtype).tobytes())
+			self.flush()
+
+	def write_meta(self):
+		with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+			json.dump(self.meta, f)
+
+	def flush(self):
+		for f in [self.keyframes, self.cells, self.owners, self.offsets, self.events, self.event_index]:
+			f.flush()
+
+	def close(self):
+		for f in [self.keyframes, self.cells, self.owners, self.offsets, self.events, self.event_index]:
+			f.close()
+		self.meta['steps'] = self.steps
+		self.meta['numbers'] = self.numbers
+		self.write_meta()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class HistoryReader():
+	"""Reconstructs the frames of a recorded simulation."""
+
+	def __init__(self, path):
+		"""Open all files of the history directory."""
+		self.path = path
+		with open(os.path.join(path, 'meta.json'), 'r') as f:
+			self.meta = json.load(f)
+		self.size = self.meta['size']
+		self.real_mode = self.meta['real_mode']
+		self.milestone = self.meta['milestone']
+		self.keyframe_interval = self.meta['keyframe_interval']
+		self.heights = np.load(os.path.join(path, 'heights.npy')) if self.real_mode else None
+
+		self.offsets = self.memmap('offsets.bin', np.int64)
+		self.steps = len(self.offsets) - 1 #Also correct if the writer never got to close the files
+		self.cells = self.memmap('cells.bin', index_dtype)
+		self.owners = self.memmap('owners.bin', owner_dtype)
+		self.keyframes = self.memmap('keyframes.bin', owner_dtype).reshape(-1, self.size, self.size)
+		self.event_index = self.memmap('events.idx', np.int64)
+		if 'numbers' in self.meta:
+			self.numbers = self.meta['numbers']
+		else: #The writer never got to close the files
+			self.numbers = max(len(self.meta['names']), int(self.owners.max()) + 1 if len(self.owners) > 0 else 0)
+
+	def memmap(self, name, dtype):
+		path = os.path.join(self.path, name)
+		if os.path.getsize(path) == 0:
+			return np.zeros(0, dtype = dtype)
+		return np.memmap(path, dtype = dtype, mode = 'r')
+
+	def updates(self, step):
+		"""Flat indices and new inhabitants of the blocks that changed hands during the given step."""
+		start, stop = self.offsets[step - 1], self.offsets[step]
+		return self.cells[start : stop], self.owners[start : stop]
+
+	def frame(self, step):
+		"""Reconstruct the field at the given step, starting from the nearest keyframe before it."""
+		keyframe = min(step // self.keyframe_interval, len(self.keyframes) - 1)
+		output = np.array(self.keyframes[keyframe])
+		start, stop = self.offsets[keyframe * self.keyframe_interval], self.offsets[step]
+		index, first = np.unique(self.cells[start : stop][::-1], return_index = True) #A block may have changed hands several times; only its last owner counts
+		output.reshape(-1)[index] = self.owners[start : stop][::-1][first]
+		return output
+
+	def frames(self, start = 0, stop = None):
+		"""Yield the fields at the steps start, start + 1, ..., stop - 1. The same array is updated in place and yielded every time."""
+		if stop is None:
+			stop = self.steps + 1
+		output = self.frame(start)
+		for step in range(start, stop):
+			if step > start:
+				index, owner = self.updates(step)
+				output.reshape(-1)[index] = owner
+			yield output
+
+	def messages(self, step):
+		"""The messages recorded during the given step."""
+		with open(os.path.join(self.path, 'events.jsonl'), 'rb') as f:
+			f.seek(self.event_index[step - 1])
+			return json.loads(f.readline())
+
+	def all_messages(self, start = 1, stop = None):
+		"""Yield the messages of the steps start, start + 1, ..., stop - 1, reading the file only once."""
+		if stop is None:
+			stop = self.steps + 1
+		with open(os.path.join(self.path, 'events.jsonl'), 'rb') as f:
+			if start <= self.steps:
+				f.seek(self.event_index[start - 1])
+			for _ in range(start, stop):
+				yield json.loads(f.readline())
@@ -1,13 +1,12 @@
 import numpy as np
-import math
-from itertools import product
+import os
 
-def random_gradient():
-	"""Create a random 2-dimensional unit gradient vector."""
-	random_x = np.random.normal() #Gaussian coordinate sampling yields uniform distribution on unit circle
-	random_y = np.random.normal()
-	norm = math.sqrt(random_x**2 + random_y**2)
-	return (random_x / norm, random_y / norm)
+def random_gradients(count, rng = None):
+	"""Create a count x count array of random 2-dimensional unit gradient vectors."""
+	if rng is None:
+		rng = np.random.default_rng()
+	gradients = rng.normal(size = (count, count, 2)) #Gaussian coordinate sampling yields uniform distribution on unit circle
+	return gradients / np.linalg.norm(gradients, axis = 2, keepdims = True)
 
 def nearby_grid_points(point, stepsize):
 	"""Given a point in 2-dimesnional space, return the 4 closest grid points on which the gradients are to be placed."""
@@ -28,44 +27,39 @@ def fade(t):
     """Smooth curve with vanishing derivative at 0 and 1."""
     return 6 * t**5 - 15 * t**4 + 10 * t**3
 
-def perlin_noise(size = 100, stepsize = 5):
+def perlin_noise(size = 100, stepsize = 5, rng = None, rows = 256):
 	"""This function creates a 2-dimensional square of dimensions given by size, with a value on each coordinate determined by Perlin noise. To do so, we create a grid, whose size is specified by stepsize, and we attach a random unit vector to each grid point. We then compute the influence at each point in our space, in terms  of dot products with the gradients. This we output."""
-	# Let's begin by creating a random gradient field
-	gradient_field = {x : random_gradient() for x in product(range(0, size + stepsize, stepsize), repeat = 2)}
-
-	# Next, we create our output field
-	output = np.zeros((size, size))
-
-	for x in range(size):
-		for y in range(size):
-			# At each point in our coordinate field, we calculate the influences at the four neighbouring grid points, and then we interpolate, first horizontally, then vertically
-			dx = x % stepsize
-			left = x - dx
-			right = left + stepsize
-
-			dy = y % stepsize
-			down = y - dy
-			up = down + stepsize
-
-			influence_1 = dot(gradient_field[(left, down)], (dx, dy))
-			influence_2 = dot(gradient_field[(left, up)], (dx, dy - stepsize))
-			influence_3 = dot(gradient_field[(right, down)], (dx - stepsize, dy))
-			influence_4 = dot(gradient_field[(right, up)], (dx - stepsize, dy - stepsize))
-			
-			ratio_x = fade(dx / stepsize)
-			ratio_y = fade(dy / stepsize)
-			
-			h_interpolate_1 = lerp(influence_1, influence_3, ratio_x)
-			h_interpolate_2 = lerp(influence_2, influence_4, ratio_x)
-
-			v_interpolate = lerp(h_interpolate_1, h_interpolate_2, ratio_y)
-
-			output[x, y] = v_interpolate
-	
+	# Let's begin by creating a random gradient field; gradients[i, j] lives on the grid point (i * stepsize, j * stepsize)
+	gradients = random_gradients(len(range(0, size + stepsize, stepsize)), rng = rng)
+
+	# Every row and column of the output lies between two grid lines; we compute these once and then broadcast, a band of rows at a time so that large maps fit in memory
+	coordinates = np.arange(size)
+	d = coordinates % stepsize
+	low = coordinates // stepsize
+	high = low + 1
+	dy = d[None, :]
+	ratio_y = fade(dy / stepsize)
+	output = np.empty((size, size))
+	for top in range(0, size, rows):
+		band = slice(top, top + rows)
+		dx = d[band, None]
+
+		# Calculate the influences at the four neighbouring grid points, and then interpolate, first horizontally, then vertically
+		influence_1 = dot(np.moveaxis(gradients[low[band, None], low[None, :]], 2, 0), (dx, dy))
+		influence_2 = dot(np.moveaxis(gradients[low[band, None], high[None, :]], 2, 0), (dx, dy - stepsize))
+		influence_3 = dot(np.moveaxis(gradients[high[band, None], low[None, :]], 2, 0), (dx - stepsize, dy))
+		influence_4 = dot(np.moveaxis(gradients[high[band, None], high[None, :]], 2, 0), (dx - stepsize, dy - stepsize))
+
+		ratio_x = fade(dx / stepsize)
+
+		h_interpolate_1 = lerp(influence_1, influence_3, ratio_x)
+		h_interpolate_2 = lerp(influence_2, influence_4, ratio_x)
+
+		output[band] = lerp(h_interpolate_1, h_interpolate_2, ratio_y)
 	return output
  
 """
-The final function will require only two inputs from the user: a size parameter between 0 and 3, and a 'granularity' parameter between 0 and 3. The latter controls the step size of the Perlin functions invoked.
+The final function will require only two inputs from the user: a size parameter between 0 and 6, and a 'granularity' parameter between 0 and 3. The latter controls the step size of the Perlin functions invoked.
 
 Although we use Perlin noise as the main mathematical tool for producing the landscape, we want to manually tweak some things to make things according to our wishes. For instance, we want to force the land to become ocean as we're nearing the border, and we want to normalise the values to lie between 0 and 1. The precise normalisation constant, however, depends on the step sizes of the Perlin noise functions, and since these in turn depend on the user's chosen parameter, it is best to just determine the appropriate constants heuristically.
 
@@ -76,30 +70,52 @@ parameter_guide = {(0, 0): [128, 15, 20], (0, 1): [128, 10, 20], (0, 2): [128, 5
 		(2, 0): [512, 60, 70], (2, 1): [512, 40, 50], (2, 2): [512, 20, 30], (2, 3): [512, 10, 20],
 		(3, 0): [1024, 120, 140], (3, 1): [1024, 80, 80], (3, 2): [1024, 40, 50], (3, 3): [1024, 20, 30]}
 
-def grid(size = 1, granularity = 1):
+#Beyond size 3, every doubling of the map doubles the step sizes, and with them the amplitude of the noise, so the normalisation factor doubles as well.
+parameter_guide.update({(size, granularity) : [value * 2**(size - 3) for value in parameter_guide[(3, granularity)]] for size in range(4, 7) for granularity in range(4)})
+
+def grid(size = 1, granularity = 1, seed = None):
 	"""Produces a height grid based on Perlin noise function."""
 	s = parameter_guide[(size, granularity)][0]
 	st = parameter_guide[(size, granularity)][1]
 	factor = parameter_guide[(size, granularity)][2]
+	rng = np.random.default_rng(seed)
 	
-	f1 = perlin_noise(size = s, stepsize = st)
-	f2 = perlin_noise(size = s, stepsize = st + 5)
-	f3 = perlin_noise(size = s, stepsize = st + 9)
-	output = np.zeros((s, s))
+	f1 = perlin_noise(size = s, stepsize = st, rng = rng)
+	f2 = perlin_noise(size = s, stepsize = st + 5, rng = rng)
+	f3 = perlin_noise(size = s, stepsize = st + 9, rng = rng)
+	perlin_output = (f1 + f2 + f3) / factor + 0.5
 	
 	h = s // 2
-	for x in range(s):
-		for y in range(s):
-			perlin_output = f1[x, y] + f2[x, y] + f3[x, y]
-			perlin_output /= factor
-			perlin_output += 0.5
-			border_correction = ((x - h)**2 + (y - h)**2) / h**2
-			total = perlin_output - border_correction
-			if total > 1:
-				output[x, y] = 1
-			elif total < 0:
-				output[x, y] = 0
-			else:
-				output[x, y] = total
-	return output
-
+	coordinates = np.arange(s) - h
+	border_correction = (coordinates[:, None]**2 + coordinates[None, :]**2) / h**2
+	return np.clip(perlin_output - border_correction, 0, 1)
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'terrain_cache') #Generated maps are stored here, keyed by (size, granularity, seed)
+
+def terrain(size = 1, granularity = 1, seed = None, cache = True):
+	"""
+	Produces everything the playing field needs to know about the map: the heights, the habitability of each block, and masks of the blocks that may be updated resp. spawned on.
+	If a seed is given, the result is stored on disk, so that asking for the same map again only costs a file read.
+	"""
+	path = os.path.join(cache_dir, 'terrain_%d_%d_%d.npz' %(size, granularity, seed)) if seed is not None else None
+	if cache and path is not None and os.path.exists(path):
+		with np.load(path) as data:
+			return data['heights'], data['habitability'], data['habitable'], data['spawnable']
+
+	heights = grid(size = size, granularity = granularity, seed = seed)
+	habitability = -abs(2 * heights - 1) + 1
+	s = heights.shape[0]
+	interior = np.zeros((s, s), dtype = bool)
+	interior[1 : s - 1, 1 : s - 1] = True
+	habitable = interior & (habitability > 0) #This is all we need to iterate over when updating the playing field.
+	interior[:] = False
+	interior[3 : s - 3, 3 : s - 3] = True
+	spawnable = interior & (habitability > 0.3) #Where a new empire might spawn.
+
+	if cache and path is not None:
+		os.makedirs(cache_dir, exist_ok = True)
+		temp_path = path + '.%d.tmp' %os.getpid() #Write to a temporary file first so that a half-written map never ends up in the cache
+		with open(temp_path, 'wb') as f:
+			np.savez(f, heights = heights, habitability = habitability, habitable = habitable, spawnable = spawnable)
+		os.replace(temp_path, path)
+	return heights, habitability, habitable, spawnable
@@ -0,0 +1,268 @@
+import numpy as np
+import heapq
+import json
+import os
+
+"""
+Population sizes are stored next to the history of the field (see history.py), in the following files.
+
+- population_serials.bin    For every step, the serial numbers of the living empires, in increasing order.
+- population_counts.bin     Their population sizes.
+- population_offsets.bin    For every step, the number of entries in the two files above up to and including that step.
+- empires.jsonl             One line per empire, in order of foundation: serial number, name, colour and the step it was founded.
+- lifespans.npy             Steps of foundation and collapse of every empire; -1 if it never collapsed.
+- population.json           Largest population size ever reached.
+
+Rows only hold living empires, so the size of the store grows with the total lifespan of all empires rather than with the number of steps times the number of empires ever founded.
+Empires are identified by their serial number, since their ordinary number may be reused after they collapse.
+"""
+
+def census(input_field):
+	"""Serial numbers and population sizes of the living empires of the field, ordered by serial number."""
+	living = input_field.empires.living
+	serials = input_field.empires.serial[living]
+	order = np.argsort(serials, kind = 'stable')
+	return serials[order].astype(np.int64), input_field.empires.count[living][order].astype(np.int64)
+
+class PopulationWriter():
+	"""Records the population sizes of a simulation step by step."""
+
+	def __init__(self, path, input_field, resume = False):
+		"""Record the living empires of the field as step 0. With resume set, carry on with the existing store from the step the field is at; see HistoryWriter."""
+		self.path = path
+		self.steps = 0
+		self.entries = 0
+		self.max_count = 0
+		self.births = []
+		self.deaths = []
+		if resume:
+			self.resume(input_field)
+			return
+		os.makedirs(path, exist_ok = True)
+
+		self.serials = open(os.path.join(path, 'population_serials.bin'), 'wb')
+		self.counts = open(os.path.join(path, 'population_counts.bin'), 'wb')
+		self.offsets = open(os.path.join(path, 'population_offsets.bin'), 'wb')
+		self.empires = open(os.path.join(path, 'empires.jsonl'), 'w')
+		self.offsets.write(np.zeros(1, dtype = np.int64).tobytes())
+		for n in input_field.empires.living:
+			self.register(input_field, n)
+		self.write_row(input_field)
+
+	def resume(self, input_field):
+		"""Cut all files off at the step the field is at, and work out the lifespans and the largest population size up to that step from the rows."""
+		self.steps = input_field.time
+		offsets = np.fromfile(os.path.join(self.path, 'population_offsets.bin'), dtype = np.int64, count = self.steps + 2) #Anything beyond the checkpoint may have been written only partially
+		if len(offsets) < self.steps + 2:
+			raise ValueError("The population store at %s does not go up to step %d, where the checkpoint is." %(self.path, self.steps))
+		self.entries = int(offsets[self.steps + 1])
+		serials = np.fromfile(os.path.join(self.path, 'population_serials.bin'), dtype = np.int64, count = self.entries)
+		counts = np.fromfile(os.path.join(self.path, 'population_counts.bin'), dtype = np.int64, count = self.entries)
+		self.max_count = int(counts.max(initial = 0))
+
+		lines = []
+		with open(os.path.join(self.path, 'empires.jsonl'), 'r') as f:
+			for line in f:
+				if not line.endswith('\n') or json.loads(line)[3] > self.steps: #The last line may have been written only partially
+					break
+				lines.append(line)
+		founded = max([json.loads(line)[0] for line in lines], default = -1) + 1
+		self.births = [-1] * founded
+		for line in lines:
+			serial, _, _, step = json.loads(line)
+			self.births[serial] = step
+		births = np.array(self.births, dtype = np.int64)
+		last = np.full(founded, -1, dtype = np.int64) #Last step at which every empire was alive
+		np.maximum.at(last, serials, np.repeat(np.arange(self.steps + 1), np.diff(offsets[: self.steps + 2])))
+		died = np.where(last >= 0, last + 1, births) #An empire that never shows up in a row collapsed in the step it was founded
+		self.deaths = np.where((last < self.steps) & (births >= 0), died, -1).tolist()
+
+		sizes = {'population_serials.bin' : self.entries * 8, 'population_counts.bin' : self.entries * 8, 'population_offsets.bin' : (self.steps + 2) * 8, 'empires.jsonl' : sum(len(line.encode()) for line in lines)}
+		files = {}
+		for name, size in sizes.items():
+			files[name] = open(os.path.join(self.path, name), 'r+b')
+			files[name].truncate(size)
+			files[name].seek(size)
+		self.serials, self.counts, self.offsets = [files[name] for name in list(sizes)[: 3]]
+		files['empires.jsonl'].close()
+		self.empires = open(os.path.join(self.path, 'empires.jsonl'), 'a')
+
+	def register(self, input_field, n):
+		"""Write down the name and colour of the newly founded empire n."""
+		serial = int(input_field.empires.serial[n])
+		self.births += [-1] * (serial + 1 - len(self.births))
+		self.deaths += [-1] * (serial + 1 - len(self.deaths))
+		self.births[serial] = self.steps
+		self.empires.write(json.dumps([serial, input_field.empires.name(n), input_field.empires.hex_colour(n), self.steps]) + '\n')
+
+	def write_row(self, input_field):
+		serials, counts = census(input_field)
+		self.serials.write(serials.tobytes())
+		self.counts.write(counts.tobytes())
+		self.entries += len(serials)
+		self.offsets.write(np.array([self.entries], dtype = np.int64).tobytes())
+		if len(counts) > 0:
+			self.max_count = max(self.max_count, int(counts.max()))
+
+	def append(self, input_field):
+		"""Record the populations after the iteration the field just went through."""
+		self.steps += 1
+		for n, t in input_field.messages:
+			if t == 1:
+				self.register(input_field, n)
+			elif t == 0:
+				self.deaths[int(input_field.empires.serial[n])] = self.steps
+		self.write_row(input_field)
+
+	def flush(self):
+		for f in [self.serials, self.counts, self.offsets, self.empires]:
+			f.flush()
+
+	def close(self):
+		for f in [self.serials, self.counts, self.offsets, self.empires]:
+			f.close()
+		np.save(os.path.join(self.path, 'lifespans.npy'), np.array([self.births, self.deaths], dtype = np.int64).reshape(2, -1).T)
+		with open(os.path.join(self.path, 'population.json'), 'w') as f:
+			json.dump({'max_count' : self.max_count}, f)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class PopulationReader():
+	"""Reads back the population sizes of a recorded simulation."""
+
+	def __init__(self, path):
+		"""Open all files of the population store."""
+		self.path = path
+		self.offsets = np.memmap(os.path.join(path, 'population_offsets.bin'), dtype = np.int64, mode = 'r')
+		self.steps = len(self.offsets) - 2 #There is a row for step 0 as well
+		self.serials = self.memmap('population_serials.bin')
+		self.counts = self.memmap('population_counts.bin')
+		self.names = []
+		self.colours = []
+		with open(os.path.join(path, 'empires.jsonl'), 'r') as f:
+			for line in f:
+				serial, name, colour, _ = json.loads(line)
+				self.names += [''] * (serial + 1 - len(self.names))
+				self.colours += ['black'] * (serial + 1 - len(self.colours))
+				self.names[serial] = name
+				self.colours[serial] = colour
+		self.lifespans = np.load(os.path.join(path, 'lifespans.npy'))
+		with open(os.path.join(path, 'population.json'), 'r') as f:
+			self.max_count = json.load(f)['max_count']
+
+	def memmap(self, name):
+		path = os.path.join(self.path, name)
+		if os.path.getsize(path) == 0:
+			return np.zeros(0, dtype = np.int64)
+		return np.memmap(path, dtype = np.int64, mode = 'r')
+
+	def row(self, step):
+		"""Serial numbers and population sizes of the empires living at the given step."""
+		start, stop = self.offsets[step], self.offsets[step + 1]
+		return self.serials[start : stop], self.counts[start : stop]
+
+	def window(self, stop, length):
+		"""
+		Population sizes at the steps stop - length + 1, ..., stop of all empires that were alive at some point in between.
+		Returns their serial numbers and a matrix with one row per empire; steps before the first one count as zero.
+		"""
+		return window_matrix([self.row(step) for step in range(max(stop - length + 1, 0), stop + 1)], length)
+
+	def deltas(self, step):
+		"""Serial numbers and new population sizes of the empires whose population changed during the given step; collapsed empires get size 0."""
+		return row_deltas(self.row(step - 1), self.row(step))
+
+def window_matrix(rows, length):
+	"""Turn the last few rows (serial numbers and population sizes) into a matrix with one row per empire and length columns, the last row being the last column."""
+	serials = np.unique(np.concatenate([row[0] for row in rows] + [np.zeros(0, dtype = np.int64)]))
+	matrix = np.zeros((len(serials), length), dtype = np.int64)
+	for i, (row_serials, row_counts) in enumerate(rows):
+		matrix[np.searchsorted(serials, row_serials), length - len(rows) + i] = row_counts
+	return serials, matrix
+
+def row_deltas(old_row, row):
+	"""Compare two consecutive rows, and return the serial numbers and new sizes of the empires that changed; collapsed empires get size 0."""
+	old_serials, old_counts = old_row
+	serials, counts = row
+	position = np.minimum(np.searchsorted(old_serials, serials), max(len(old_serials) - 1, 0))
+	if len(old_serials) > 0:
+		changed = (old_serials[position] != serials) | (old_counts[position] != counts)
+	else:
+		changed = np.ones(len(serials), dtype = bool)
+	gone = old_serials[~np.isin(old_serials, serials)]
+	return np.concatenate((serials[changed], gone)), np.concatenate((counts[changed], np.zeros(len(gone), dtype = np.int64)))
+
+class Window():
+	"""Keeps track of the population sizes of the last few steps of all empires alive at some point in between, like window_matrix(), given only the population sizes that changed."""
+
+	def __init__(self, length, rows = ()):
+		"""Start from the last few rows (serial numbers and population sizes) that are already known."""
+		self.length = length
+		self.serials, self.counts = window_matrix(list(rows)[-length :], length) #The columns of counts are used in turn, so the oldest column is the one to be overwritten next
+		self.column = 0
+		self.step = 0
+		alive = self.counts > 0
+		last = np.where(alive.any(axis = 1), length - 1 - np.argmax(alive[:, ::-1], axis = 1), -1) #Last column in which the empire was alive
+		self.extinct = last - length + 2 #Step since which the population size has been 0; only meaningful for empires that are gone
+
+	def update(self, serials, counts):
+		"""Process the new population sizes of some empires, as in Ranking.update(), and move on to the next step."""
+		self.step += 1
+		new = ~np.isin(serials, self.serials)
+		if new.any():
+			added = np.sort(serials[new])
+			position = np.searchsorted(self.serials, added)
+			self.serials = np.insert(self.serials, position, added)
+			self.counts = np.insert(self.counts, position, 0, axis = 0)
+			self.extinct = np.insert(self.extinct, position, self.step)
+		self.counts[:, self.column] = self.counts[:, self.column - 1]
+		position = np.searchsorted(self.serials, serials)
+		self.counts[position, self.column] = counts
+		self.extinct[position[counts == 0]] = self.step
+		self.column = (self.column + 1) % self.length
+		gone = (self.counts[:, self.column - 1] == 0) & (self.extinct <= self.step - self.length + 1) #Empires that were not alive at any of the last few steps
+		if gone.any():
+			self.serials, self.counts, self.extinct = self.serials[~gone], self.counts[~gone], self.extinct[~gone]
+
+	def window(self):
+		"""Serial numbers and the matrix with one row per empire, oldest step first, as returned by window_matrix()."""
+		return self.serials, np.roll(self.counts, -self.column, axis = 1)
+
+class Ranking():
+	"""Keeps track of the k largest empires, given only the population sizes that changed."""
+
+	def __init__(self, k = 10):
+		"""Initialise attributes."""
+		self.k = k
+		self.counts = {} #Population size of every living empire
+		self.top = [] #Serial numbers of the k largest empires, largest first
+
+	def update(self, serials, counts):
+		"""Process the new population sizes of some empires; a size of 0 means the empire collapsed."""
+		threshold = self.key(self.top[-1]) if len(self.top) == self.k else (0, 0) #Every empire outside the top ranks below this
+		for serial, count in zip(serials.tolist(), counts.tolist()):
+			if count > 0:
+				self.counts[serial] = count
+			else:
+				self.counts.pop(serial, None)
+
+		candidates = set(serial for serial in self.top if serial in self.counts)
+		candidates.update(serial for serial in serials.tolist() if serial in self.counts)
+		top = heapq.nlargest(self.k, candidates, key = self.key)
+		if len(self.counts) > len(candidates) and (len(top) < self.k or self.key(top[-1]) < threshold):
+			#An empire outside the top might have overtaken one that shrank, so we have to look at everyone.
+			top = heapq.nlargest(self.k, self.counts, key = self.key)
+		self.top = top
+
+	def key(self, serial):
+		"""Empires are ranked by population size; ties go to the oldest empire, which has the lowest serial number."""
+		return self.counts[serial], -serial
+
+	def __iter__(self):
+		"""Yield serial numbers and population sizes of the largest empires, largest first."""
+		for serial in self.top:
+			yield serial, self.counts[serial]
@@ -0,0 +1,360 @@
+import numpy as np
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import matplotlib
+from PIL import Image, ImageDraw, ImageFont
+import field
+from history import HistoryReader
+from population import PopulationReader, Ranking, Window, row_deltas
+from tqdm import tqdm
+
+"""
+Renders the frames of a recorded simulation directly into pixel arrays, without going through Matplotlib's artists.
+The layout mirrors the Matplotlib animation in simulate.py: the playing field on the left, the population plot on the top right, and the leaderboard and news on the bottom right.
+Frames are drawn either from a recorded history (Renderer) or straight from a running simulation (StreamRenderer).
+"""
+
+history = 100 * field.slow_factor #This tracks how many frames the graphs show.
+font_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'df.ttf')
+
+def hex_to_rgb(colour):
+	"""Turn a colour like '#FF8000' (or 'black') into an RGB triple."""
+	if colour == 'black':
+		return (0, 0, 0)
+	return tuple(int(colour[i : i + 2], 16) for i in (1, 3, 5))
+
+def news(messages, previous_messages, step, milestone):
+	"""
+	Turn the messages of a step into news lines, each consisting of a colour and a text.
+	The wording only depends on the step and the empire involved, so that a frame looks the same no matter in which order the frames get rendered.
+	"""
+	lines = []
+	for message in messages:
+		n, t, name, colour = message
+		p = (step + n) % 2
+		if t == 0:
+			lines.append([colour, name + (' has perished!' if p == 0 else ' has collapsed!')])
+		elif t == 1:
+			lines.append([colour, name + (' was established!' if p == 0 else ' was founded!')])
+		elif t == 2:
+			lines.append([colour, name + ' reached the age of ' + str(milestone) +'.'])
+		elif t == 3 and step > 50 * field.slow_factor + 1 and message not in previous_messages:
+			lines.append([colour, name + ' is dominating the world!'])
+	return lines
+
+class Canvas():
+	"""Draws frames into RGB arrays, given everything that is to be shown on them."""
+
+	def __init__(self, size, real_mode, heights = None, width = 2880, height = 1440):
+		"""Prepare everything that stays the same throughout the animation."""
+		self.width = width
+		self.height = height
+		self.margin = height // 60
+
+		#The playing field is a square on the left; blocks get scaled up by nearest-neighbour sampling.
+		self.map_side = height - 2 * self.margin
+		self.map_rows = np.arange(self.map_side) * size // self.map_side
+		self.map_columns = self.map_rows
+		self.sample_first = size > self.map_side #A field with more blocks than pixels gets sampled down before it is coloured in, so the cost of a frame does not grow with the size of the field
+
+		#The terrain shines through the empires just like with alpha = 0.85 in the Matplotlib version, so we blend it once in advance.
+		if real_mode:
+			sampled = self.sample(heights) if self.sample_first else heights
+			terrain = matplotlib.colormaps['terrain']((sampled - heights.min()) / max(heights.max() - heights.min(), 1e-12))[:, :, : 3] #Same normalisation as imshow
+			self.background = np.floor(0.15 * 255 * terrain).astype(np.uint8)
+		else:
+			side = self.map_side if self.sample_first else size
+			self.background = np.zeros((side, side, 3), dtype = np.uint8)
+
+		#Population plot and text panel on the right.
+		self.chart_left = width // 2 + self.margin
+		self.chart_width = width - self.chart_left - self.margin
+		self.chart_top = self.margin
+		self.chart_height = height // 2 - 2 * self.margin
+		self.text_left = self.chart_left
+		self.text_top = height // 2
+		self.line_height = (height - self.text_top - self.margin) // 21 #Ten lines for news messages; ten lines for the populations of the ten largest empires; one empty line in between
+		self.font = ImageFont.truetype(font_file, int(self.line_height * 0.9))
+		self.text_cache = {}
+
+	def sample(self, array):
+		"""The blocks of the field that end up on the pixels of the map."""
+		return array.take(self.map_rows, axis = 0).take(self.map_columns, axis = 1)
+
+	def colour_table(self, colours):
+		"""Colours of the empires with the alpha = 0.85 blending already applied."""
+		return np.floor(0.85 * np.array([hex_to_rgb(colour) for colour in colours], dtype = float)).astype(np.uint8)
+
+	def text(self, text, colour):
+		"""Rendered text line as an RGB array with a mask, cached since most lines stay the same for many frames."""
+		key = (text, colour)
+		if key not in self.text_cache:
+			if len(self.text_cache) > 1000:
+				self.text_cache = {}
+			mask = Image.new('L', (self.width - self.text_left, self.line_height))
+			ImageDraw.Draw(mask).text((0, 0), text, fill = 255, font = self.font)
+			mask = np.asarray(mask)
+			columns = np.flatnonzero(mask.any(axis = 0))
+			mask = mask[:, : columns[-1] + 1] if len(columns) > 0 else mask[:, : 0]
+			self.text_cache[key] = (mask[:, :, None].astype(np.uint16), np.array(hex_to_rgb(colour), dtype = np.uint16))
+		return self.text_cache[key]
+
+	def draw_text(self, image, line, text, colour):
+		"""Draw text on the given line of the text panel; line 0 is the bottom one."""
+		mask, rgb = self.text(text, colour)
+		top = self.height - self.margin - (line + 1) * self.line_height
+		area = image[top : top + mask.shape[0], self.text_left : self.text_left + mask.shape[1]]
+		area[:] = ((255 - mask) * area + mask * rgb) // 255
+
+	def draw_chart(self, image, counts, colours, max_count):
+		"""Draw the population plot: one polyline per row of counts, all segments rasterised at once."""
+		if len(counts) == 0:
+			return
+		x = np.arange(history) * (self.chart_width - 1) / (history - 1)
+		y = (self.chart_height - 1) * (1 - counts / (max_count + 1))
+		x0 = np.broadcast_to(x[: -1], y[:, : -1].shape).reshape(-1)
+		x1 = np.broadcast_to(x[1 :], y[:, 1 :].shape).reshape(-1)
+		y0 = y[:, : -1].reshape(-1)
+		y1 = y[:, 1 :].reshape(-1)
+		colours = np.array([hex_to_rgb(colour) for colour in colours], dtype = np.uint8)
+		segment_colours = np.repeat(colours, history - 1, axis = 0)
+
+		#Sample every segment at (at least) one point per pixel.
+		steps = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1
+		segment = np.repeat(np.arange(len(steps)), steps)
+		t = (np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(np.maximum(steps - 1, 1), steps)
+		px = np.rint(x0[segment] + t * (x1[segment] - x0[segment])).astype(np.int64)
+		py = np.rint(y0[segment] + t * (y1[segment] - y0[segment])).astype(np.int64)
+		chart = image[self.chart_top : self.chart_top + self.chart_height, self.chart_left : self.chart_left + self.chart_width]
+		for dy in (0, 1): #Lines are two pixels thick
+			chart[np.minimum(py + dy, self.chart_height - 1), px] = segment_colours[segment]
+
+	def draw(self, data, colour_table, counts, line_colours, max_count, leaderboard, news_log):
+		"""
+		Draw a whole frame: the field with the given colour table, the population plot (one row of counts and one colour per line), the leaderboard as (name, colour, size) triples, and the news log as (colour, text) pairs.
+		"""
+		image = np.zeros((self.height, self.width, 3), dtype = np.uint8)
+		if self.sample_first:
+			blended = colour_table[self.sample(data)] + self.background
+		else:
+			blended = self.sample(colour_table[data] + self.background)
+		image[self.margin : self.margin + self.map_side, self.margin : self.margin + self.map_side] = blended
+		self.draw_chart(image, counts, line_colours, max_count)
+		for i, (name, colour, value) in enumerate(leaderboard):
+			self.draw_text(image, 20 - i, name + ": " + str(value), colour)
+		for i in range(10):
+			self.draw_text(image, i, news_log[i][1], news_log[i][0])
+		return image
+
+class Renderer(Canvas):
+	"""Draws the frames of a recorded simulation."""
+
+	def __init__(self, history_reader, population_reader, width = 2880, height = 1440):
+		"""Prepare everything that stays the same throughout the animation."""
+		Canvas.__init__(self, history_reader.size, history_reader.real_mode, history_reader.heights, width = width, height = height)
+		self.history_reader = history_reader
+		self.population_reader = population_reader
+
+	def frames(self, start = 0, stop = None):
+		"""Yield the frames start, start + 1, ..., stop - 1 as RGB arrays. Frame i shows the field after i + 1 iterations."""
+		history_reader = self.history_reader
+		population_reader = self.population_reader
+		if stop is None:
+			stop = history_reader.steps
+
+		#Catch up on everything that happened before the first frame: colours of recycled numbers, the news log and the ranking.
+		colours = list(history_reader.meta['colours'])
+		colours += ['black'] * (history_reader.numbers - len(colours))
+		news_log = [['black', ""] for i in range(10)]
+		previous_messages = []
+		for step, messages in enumerate(history_reader.all_messages(1, start + 1), start = 1):
+			for message in messages:
+				if message[1] == 1:
+					colours[message[0]] = message[3]
+			news_log = (news_log + news(messages, previous_messages, step, history_reader.milestone))[-10 :]
+			previous_messages = messages
+		colour_table = self.colour_table(colours)
+		ranking = Ranking(k = 10)
+		ranking.update(*population_reader.row(start))
+		window = Window(history, [population_reader.row(step) for step in range(max(start - history + 1, 0), start + 1)])
+
+		data = history_reader.frame(start)
+		flat = data.reshape(-1)
+		for frame, messages in enumerate(history_reader.all_messages(start + 1, stop + 1), start = start):
+			step = frame + 1
+			index, owner = history_reader.updates(step)
+			flat[index] = owner
+			for message in messages:
+				if message[1] == 1: #Empires founded on this frame may have taken over the number of a perished empire, so they bring their own colour.
+					colour_table[message[0]] = self.colour_table([message[3]])[0]
+			news_log = (news_log + news(messages, previous_messages, step, history_reader.milestone))[-10 :]
+			previous_messages = messages
+			deltas = population_reader.deltas(step)
+			ranking.update(*deltas)
+			window.update(*deltas)
+
+			serials, counts = window.window()
+			line_colours = [population_reader.colours[serial] for serial in serials.tolist()]
+			leaderboard = [(population_reader.names[serial], population_reader.colours[serial], value) for serial, value in ranking]
+			yield self.draw(data, colour_table, counts, line_colours, population_reader.max_count, leaderboard, news_log)
+
+class StreamRenderer(Canvas):
+	"""
+	Draws frames while the simulation is still running, from records that the simulation hands over step by step.
+	A record consists of the flat indices and new owners of the blocks that changed, the messages of the step, the population row (serial numbers and sizes of the living empires) and the foundations of the step as (serial number, name, colour).
+	Only the last population row, the population sizes of the empires in the plot and their names are kept, so memory use does not grow with the length of the simulation.
+	"""
+
+	def __init__(self, size, real_mode, heights, inhabitants, colours, milestone, row, foundations, width = 2880, height = 1440):
+		"""Set up the state of the first frame."""
+		Canvas.__init__(self, size, real_mode, heights, width = width, height = height)
+		self.data = np.array(inhabitants, dtype = np.uint32)
+		self.colours = self.colour_table(colours)
+		self.milestone = milestone
+		self.step = 0
+		self.empires = {serial : (name, colour) for serial, name, colour in foundations} #Names and colours of the empires that are visible in the population plot
+		self.row = row
+		self.window = Window(history, [row])
+		self.max_count = int(row[1].max()) if len(row[1]) > 0 else 0
+		self.news_log = [['black', ""] for i in range(10)]
+		self.previous_messages = []
+		self.ranking = Ranking(k = 10)
+		self.ranking.update(*row)
+
+	def frame(self, record):
+		"""Process the next record and draw the resulting frame."""
+		index, owner, messages, row, foundations = record
+		self.step += 1
+		numbers = max([int(owner.max(initial = 0))] + [message[0] for message in messages]) + 1
+		if numbers > len(self.colours):
+			self.colours = np.concatenate((self.colours, np.zeros((numbers - len(self.colours), 3), dtype = np.uint8)))
+		self.data.reshape(-1)[index] = owner
+		for message in messages:
+			if message[1] == 1:
+				self.colours[message[0]] = self.colour_table([message[3]])[0]
+		for serial, name, colour in foundations:
+			self.empires[serial] = (name, colour)
+		self.news_log = (self.news_log + news(messages, self.previous_messages, self.step, self.milestone))[-10 :]
+		self.previous_messages = messages
+		deltas = row_deltas(self.row, row)
+		self.ranking.update(*deltas)
+		self.window.update(*deltas)
+		self.row = row
+		if len(row[1]) > 0:
+			self.max_count = max(self.max_count, int(row[1].max())) #The plot can only know the largest size so far, so its scale grows over time
+
+		serials, counts = self.window.window()
+		visible = set(serials.tolist())
+		for serial in [serial for serial in self.empires if serial not in visible]:
+			del self.empires[serial]
+		line_colours = [self.empires[serial][1] for serial in serials.tolist()]
+		leaderboard = [(self.empires[serial][0], self.empires[serial][1], value) for serial, value in self.ranking]
+		return self.draw(self.data, self.colours, counts, line_colours, self.max_count, leaderboard, self.news_log)
+
+def render(history_reader, population_reader, output, fps = 15, width = 2880, height = 1440, codec = 'libx265', preset = 'medium'):
+	"""Render a recorded simulation and encode it into output.mp4."""
+	renderer = Renderer(history_reader, population_reader, width = width, height = height)
+	with FFmpegWriter(output + '.mp4', width, height, fps = fps, codec = codec, preset = preset) as writer:
+		for image in tqdm(renderer.frames(), total = history_reader.steps, bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}'):
+			writer.write(image)
+
+def render_segment(task):
+	"""Render the frames start, ..., stop - 1 of the recorded simulation at path into their own video file. Runs in a worker process."""
+	path, segment, start, stop, fps, width, height, codec, preset = task
+	renderer = Renderer(HistoryReader(path), PopulationReader(path), width = width, height = height)
+	with FFmpegWriter(segment, width, height, fps = fps, codec = codec, preset = preset, threads = 1) as writer:
+		for image in renderer.frames(start, stop):
+			writer.write(image)
+	return stop - start
+
+def render_parallel(path, output, workers = None, fps = 15, width = 2880, height = 1440, codec = 'libx265', preset = 'medium'):
+	"""
+	Render the recorded simulation at path into output.mp4 using several worker processes.
+	The frames are split into consecutive segments; every worker reconstructs the field at the start of its segment from the nearest keyframe, renders and encodes the segment on its own, and afterwards the segments are glued together in order without re-encoding.
+	Since every frame only depends on the recorded history, the frames that go into the encoder are the same as those of render(). The video itself may differ slightly, though: every segment is encoded on its own, starting with a keyframe, and a lossy codec spends its bits differently around those.
+	A recording without any steps is rendered by render() instead, as there is nothing to split.
+	"""
+	if workers is None:
+		workers = os.cpu_count()
+	steps = HistoryReader(path).steps
+	if steps == 0:
+		render(HistoryReader(path), PopulationReader(path), output, fps = fps, width = width, height = height, codec = codec, preset = preset)
+		return
+	segments = min(2 * workers, steps) #A few more segments than workers evens out differences in rendering time
+	bounds = [steps * i // segments for i in range(segments + 1)]
+	segment_dir = output + '.segments'
+	os.makedirs(segment_dir, exist_ok = True)
+	tasks = [(path, os.path.join(segment_dir, 'segment_%05d.mp4' %i), bounds[i], bounds[i + 1], fps, width, height, codec, preset) for i in range(segments)]
+
+	with multiprocessing.Pool(workers) as pool:
+		with tqdm(total = steps, bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}') as progress_bar:
+			for frames in pool.imap_unordered(render_segment, tasks):
+				progress_bar.update(frames)
+
+	segment_list = os.path.join(segment_dir, 'segments.txt')
+	with open(segment_list, 'w') as f:
+		for task in tasks:
+			f.write("file '%s'\n" %os.path.abspath(task[1]))
+	subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', segment_list, '-c', 'copy', output + '.mp4'], check = True)
+	shutil.rmtree(segment_dir)
+
+def render_stream(records, output, setup, fps = 15, width = 2880, height = 1440, codec = 'libx265', preset = 'medium'):
+	"""
+	Render the records of a running simulation as they come in, and encode them into output.mp4. Runs in its own process; see simulate.py.
+	The setup holds the arguments of StreamRenderer, and the stream ends with None. Drawing and encoding run side by side, with at most a few drawn frames waiting in between.
+	"""
+	renderer = StreamRenderer(*setup, width = width, height = height)
+	images = queue.Queue(maxsize = 4) #Drawing stops whenever the encoder falls behind, and so does the simulation further upstream
+	errors = []
+
+	def encode():
+		try:
+			with FFmpegWriter(output + '.mp4', width, height, fps = fps, codec = codec, preset = preset) as writer:
+				image = images.get()
+				while image is not None:
+					writer.write(image)
+					image = images.get()
+		except Exception as error:
+			errors.append(error)
+			while images.get() is not None: #Keep draining, so the drawing side does not get stuck
+				pass
+
+	encoder = threading.Thread(target = encode)
+	encoder.start()
+	try:
+		record = records.get()
+		while record is not None:
+			images.put(renderer.frame(record))
+			record = records.get()
+	finally:
+		images.put(None)
+		encoder.join()
+	if errors:
+		raise errors[0]
+
+class FFmpegWriter():
+	"""Streams raw RGB frames into an ffmpeg process."""
+
+	def __init__(self, output, width, height, fps = 15, codec = 'libx265', preset = 'medium', threads = 0):
+		"""Start ffmpeg, reading frames from its standard input. At this resolution, libx265 is usually the bottleneck; a faster preset or libx264 helps if that matters more than file size."""
+		command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' %(width, height), '-r', str(fps), '-i', '-',
+			'-vcodec', codec, '-preset', preset, '-pix_fmt', 'yuv420p', '-threads', str(threads), output] #threads = 0 lets the encoder decide
+		self.process = subprocess.Popen(command, stdin = subprocess.PIPE)
+
+	def write(self, image):
+		self.process.stdin.write(image.tobytes())
+
+	def close(self):
+		self.process.stdin.close()
+		if self.process.wait() != 0:
+			raise RuntimeError("ffmpeg exited with status %d" %self.process.returncode)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -1,66 +1,160 @@
 import numpy as np
-import random
+import multiprocessing
+import queue
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import matplotlib.colors as colors
 import matplotlib.font_manager as font_manager
+import os
 import time
 import field
+import tiled
+from history import HistoryWriter, HistoryReader
+from population import PopulationWriter, PopulationReader, Ranking, Window, census
+from render import news, render, render_parallel, render_stream
 from tqdm import tqdm
 
 history = 100 * field.slow_factor #This tracks how many frames the graphs show.
 
 start = time.time()
 
-def simulate(input_field, iterations, output):
+def simulate(input_field, iterations, output, backend = 'matplotlib', workers = 1, checkpoint_interval = None, resume = False):
 	"""
 	We're given a playing field, and a number of iterations to let the playing field do its thing.
 	We simulate the game and we capture the relevant data at each time frame.
 	Then we take this information and we create an animation using Matplotlib.
+	The history of the simulation is kept on disk, next to the video, so that the same run can be animated or analysed again later on.
+	The backend is either 'matplotlib', the reference animation, or 'raster', which draws the frames directly and is a lot faster; the latter can spread the work over several worker processes.
+	With backend 'stream', the frames are drawn and encoded in a separate process while the simulation is still running, so the video grows right from the start and memory use does not depend on the number of iterations.
+	Every checkpoint_interval iterations, the field is saved next to the history, so that a run that crashed can be picked up again with resume() below.
 	"""
 	#Initialise the datasets.
-	data = np.copy(input_field.inhabitants) #Field on first frame
-	data_updates = [] #This will contain the playing field info at every timeframe
-	population_count = [] #Keeps track of the population sizes of every empire
-	messages = [] #Holds the messages that need to be displayed
+	if resume and backend == 'stream':
+		raise ValueError("A streamed video cannot be resumed; use the 'raster' backend instead.")
+	history_writer = HistoryWriter(output + '.history', input_field, resume = resume) #This will contain the playing field info at every timeframe
+	population_writer = PopulationWriter(output + '.history', input_field, resume = resume) #Keeps track of the population sizes of every living empire
+	if backend == 'stream':
+		stream = Stream(input_field, output)
+	if resume:
+		iterations = max(iterations - input_field.time, 0) #Only the remaining iterations are left to do, if any
 
 	#Run the simulation.
 	print("Starting simulation...")
-	for i in tqdm(range(iterations), bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}'): #tqdm() generates a progress bar
-		input_field.iterate()
-		data_updates.append(input_field.update.copy()) #We keep track of the updates of the field.
-		census = [empire.count for empire in input_field.empires] #Notice that this list becomes longer as we go on
-		population_count.append(census)
-		messages.append(input_field.messages)
+	frontier_sizes = np.zeros(iterations, dtype = np.int64) #Number of blocks probed at every timeframe; this is what the cost of an iteration scales with
+	progress_bar = tqdm(range(iterations), bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}') #tqdm() generates a progress bar
+	try:
+		for i in progress_bar:
+			input_field.iterate()
+			frontier_sizes[i] = input_field.frontier_size
+			progress_bar.set_postfix(frontier = input_field.frontier_size, refresh = False)
+			messages = [[int(n), t, input_field.empires.name(n), input_field.empires.hex_colour(n)] for n, t in input_field.messages] #Names and colours are looked up right away, since empire numbers may be reused later on
+			history_writer.append(input_field, messages) #We keep track of the updates of the field.
+			population_writer.append(input_field)
+			if backend == 'stream':
+				stream.append(input_field, messages)
+			if checkpoint_interval is not None and input_field.time % checkpoint_interval == 0:
+				history_writer.flush()
+				population_writer.flush()
+				input_field.save(checkpoint_file(output)) #Written last, so that everything up to the checkpoint is in the history by then
+	except BaseException: #Also on Ctrl-C
+		if backend == 'stream':
+			stream.abort()
+		raise
+	history_writer.close()
+	population_writer.close()
+	if backend == 'stream':
+		print("Finishing video...")
+		stream.close()
+
+	if iterations > 0:
+		print("Frontier size: mean %d, max %d, final %d." %(frontier_sizes.mean(), frontier_sizes.max(), frontier_sizes[-1]))
+	if input_field.profile is not None:
+		summary = input_field.profile.summary()
+		print("Time per phase: " + ", ".join("%s %.2f s" %(phase, summary[phase]) for phase in field.Profile.phases) + ".")
+
+	if backend == 'stream':
+		print("Done!")
+		print("Time elapsed:", time.time() - start, "seconds.")
+	elif backend == 'raster':
+		print("Rendering frames...")
+		if workers > 1:
+			render_parallel(output + '.history', output, workers = workers)
+		else:
+			render(HistoryReader(output + '.history'), PopulationReader(output + '.history'), output)
+		print("Done!")
+		print("Time elapsed:", time.time() - start, "seconds.")
+	else:
+		animate(HistoryReader(output + '.history'), PopulationReader(output + '.history'), output)
+
+def checkpoint_file(output):
+	return os.path.join(output + '.history', 'checkpoint.npz')
+
+def resume(output, iterations, backend = 'raster', workers = 1, checkpoint_interval = None):
+	"""
+	Continue a simulation that got interrupted, from the last checkpoint it saved, up to a total of the given number of iterations.
+	The history and video come out exactly the same as if the run had never been interrupted.
+	A run on a TiledField carries on with the given number of worker processes.
+	"""
+	if field.meta(checkpoint_file(output)).get('tiled', False):
+		input_field = tiled.load(checkpoint_file(output), workers = workers)
+	else:
+		input_field = field.load(checkpoint_file(output))
+	print("Resuming from iteration %d..." %input_field.time)
+	try:
+		simulate(input_field, iterations, output, backend = backend, workers = workers, checkpoint_interval = checkpoint_interval, resume = True)
+	finally:
+		if input_field.tiled:
+			input_field.close() #Stop the worker processes
+
+class Stream():
+	"""Hands the simulation over to a renderer process step by step; see render_stream() in render.py."""
+
+	def __init__(self, input_field, output, maxsize = 16):
+		"""Start the renderer process with the field as it is now. At most maxsize steps can be waiting to be drawn; beyond that, the simulation waits for the renderer."""
+		empires = input_field.empires
+		setup = (input_field.size, input_field.real_mode, input_field.heights if input_field.real_mode else None, input_field.inhabitants,
+			[empires.hex_colour(n) for n in range(len(empires))], input_field.milestone, census(input_field),
+			[(int(empires.serial[n]), empires.name(n), empires.hex_colour(n)) for n in empires.living])
+		self.records = multiprocessing.Queue(maxsize = maxsize)
+		self.process = multiprocessing.Process(target = render_stream, args = (self.records, output, setup), daemon = True)
+		self.process.start()
+
+	def put(self, record):
+		while True:
+			try:
+				self.records.put(record, timeout = 1)
+				return
+			except queue.Full:
+				if not self.process.is_alive():
+					raise RuntimeError("Renderer process exited with status %s" %self.process.exitcode)
+
+	def append(self, input_field, messages):
+		"""Send the iteration the field just went through, with messages as recorded in the history."""
+		empires = input_field.empires
+		foundations = [(int(empires.serial[n]), empires.name(n), empires.hex_colour(n)) for n, t in input_field.messages if t == 1]
+		self.put((input_field.update_index.astype(np.uint32), input_field.update_owner.astype(np.uint32), messages, census(input_field), foundations))
+
+	def close(self):
+		"""Wait for the renderer to finish the video."""
+		self.put(None)
+		self.process.join()
+		if self.process.exitcode != 0:
+			raise RuntimeError("Renderer process exited with status %s" %self.process.exitcode)
+
+	def abort(self):
+		"""Stop the renderer right away, when the simulation broke off; otherwise it would keep waiting for the next step."""
+		self.process.terminate()
+		self.process.join()
+
+def animate(history_reader, population_reader, output):
+	"""Create an animation out of a recorded simulation."""
+	iterations = history_reader.steps
+	data = history_reader.frame(0) #Field on first frame
+	colour_list = list(history_reader.meta['colours']) #Colours of the empires on the first frame; they change whenever a number gets recycled
 
 	print("Post-processing data...")
-	#Post-processing population_count: make the list equally long and add a history of trailing zeros.
-	empire_count = len(population_count[-1])
-	processed_count = [[0 for _ in range(empire_count)] for _ in range(history)]
-	for census in population_count:
-		length = len(census)
-		census = census + [0] * (empire_count - length)
-		processed_count.append(census)
-	#Post-processing messages.
-	processed_messages = [[] for _ in range(iterations)]
-	for i in range(iterations):
-		for message in messages[i]:
-			if message[1] == 0:
-				p = random.choice(range(2))
-				if p == 0:
-					processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' has perished!'])
-				else:
-					processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' has collapsed!'])
-			elif message[1] == 1:
-				p = random.choice(range(2))
-				if p == 0:
-					processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' was established!'])
-				else:
-					processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' was founded!'])
-			elif message[1] == 2:
-				processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' reached the age of ' + str(input_field.milestone) +'.'])
-			elif message[1] == 3 and i > 50 * field.slow_factor and message not in messages[i - 1]:
-					processed_messages[i].append([message[0], input_field.empires[message[0]].name + ' is dominating the world!'])
+	empire_count = history_reader.numbers
+	colour_list += ['black'] * (empire_count - len(colour_list))
 
 	#We now initiate figure to draw on.
 	print("Preparing animation...")
@@ -75,30 +169,31 @@ def simulate(input_field, iterations, output):
 	ax1.axis('off')
 	ax2.axis('off')
 	ax3.axis('off')
-	max_y = max([max(processed_count[i][1 : ]) for i in range(history + iterations)]) #Determine range of population size plot (would be wrongly determined on frame 0 otherwise)
+	max_y = population_reader.max_count #Determine range of population size plot (would be wrongly determined on frame 0 otherwise)
 	ax2.set_ylim([0, max_y + 1])
+	ax2.set_xlim([0, history - 1])
 	ax3.axis([0, 1, 0, 21]) #Ten lines for news messages; ten lines for the populations of the ten largest empires; one empty line in between
 	plt.tight_layout()
 
 	#Create colour map.
-	colour_list = [empire.colour for empire in input_field.empires] #Every empire has its own colour which we now import
-	cmap = colors.ListedColormap(colour_list)
+	palette = list(colour_list) #Every empire has its own colour; the palette is kept up to date while animating
+	cmap = colors.ListedColormap(palette)
 	boundaries = [n - 1/2 for n in range(empire_count + 1)] #Half-integer value to prevent rounding problems
 	norm = colors.BoundaryNorm(boundaries, cmap.N, clip = True)
 
 	#Create first frame.
 	print("Drawing initial frame...")
-	if input_field.real_mode:
-		im1 = ax1.imshow(input_field.heights, cmap = 'terrain')
+	if history_reader.real_mode:
+		im1 = ax1.imshow(history_reader.heights, cmap = 'terrain')
 	im1 = ax1.imshow(data, cmap = cmap, norm = norm, alpha = 0.85)
 
-	im2s = {}
-	for n in range(1, empire_count):
-		im2, = ax2.plot([processed_count[i][n] for i in range(history)], color = colour_list[n]) #Matplotlib will kill you if you remove the ,
-		im2s[n] = im2
+	im2s = {} #One line per empire visible in the population plot, indexed by serial number
+	ranking = Ranking(k = 10) #The ten largest empires, for the leaderboard
+	ranking.update(*population_reader.row(0))
+	window = Window(history, [population_reader.row(0)]) #The population sizes shown in the population plot
 
 	im3s = {}
-	news_log = [[0, ""] for i in range(10)]
+	news_log = [['black', ""] for i in range(10)]
 	for i in range(10):
 		im3 = ax3.text(0, i, news_log[i], color = 'white', fontsize = 16)
 		im3s[i] = im3
@@ -111,32 +206,52 @@ def simulate(input_field, iterations, output):
 		"""This function specifies how the animation should progress."""
 		save_progress_bar.update(1)
 
-		for x in data_updates[frame]:
-			data[x] = data_updates[frame][x]
-		im1.set_array(data)
+		index, owner = history_reader.updates(frame + 1)
+		data.reshape(-1)[index] = owner
 		update = (im1,)
 
-		for n in range(1, empire_count):
-			im2s[n].set_data(range(history), [processed_count[i + frame][n] for i in range(history)])
-			update += (im2s[n],)
+		messages = history_reader.messages(frame + 1) #Messages are read and post-processed one frame at a time, as the animation gets to them
+		previous_messages = history_reader.messages(frame) if frame > 0 else []
+
+		#Empires founded on this frame may have taken over the number of a perished empire, so they bring their own colour.
+		founded = [message for message in messages if message[1] == 1]
+		for message in founded:
+			palette[message[0]] = message[3]
+		if founded:
+			im1.set_cmap(colors.ListedColormap(palette))
+		im1.set_array(data)
+
+		#Only the empires alive at some point during the last few frames show up in the population plot.
+		deltas = population_reader.deltas(frame + 1)
+		window.update(*deltas)
+		serials, counts = window.window()
+		visible = set(serials.tolist())
+		for serial in list(im2s):
+			if serial not in visible:
+				im2s.pop(serial).remove()
+		for serial, count in zip(serials.tolist(), counts):
+			if serial not in im2s:
+				im2s[serial], = ax2.plot(range(history), count, color = population_reader.colours[serial]) #Matplotlib will kill you if you remove the ,
+			else:
+				im2s[serial].set_ydata(count)
+			update += (im2s[serial],)
 
-		for message in processed_messages[frame]:
+		for message in news(messages, previous_messages, frame + 1, history_reader.milestone): #Every processed message consists of a colour and a text
 			news_log.append(message)
 			del news_log[0]
 		for i in range(10):
 			im3s[i].set_text(news_log[i][1])
-			im3s[i].set_color(colour_list[news_log[i][0]])
+			im3s[i].set_color(news_log[i][0])
 			update += (im3s[i],)
 		
-		top10 = sorted(range(1, empire_count), key = lambda i : processed_count[history + frame][i], reverse = True)[ : 10]
-		for i in range(len(top10)): #The length might be <10 if there were < 10 empires overall which is why we don't write range(10)
-			value = processed_count[history + frame][top10[i]]
-			if value > 0:
-				im4s[i].set_text(input_field.empires[top10[i]].name + ": " + str(value))
-				im4s[i].set_color(colour_list[top10[i]])
-				update += (im4s[i],)
-			else: #Don't display empires with population 0
-				break
+		ranking.update(*deltas)
+		for i, (serial, value) in enumerate(ranking):
+			im4s[i].set_text(population_reader.names[serial] + ": " + str(value))
+			im4s[i].set_color(population_reader.colours[serial])
+			update += (im4s[i],)
+		for i in range(len(ranking.top), 10): #There might be <10 empires alive
+			im4s[i].set_text("")
+			update += (im4s[i],)
 
 		return update
 
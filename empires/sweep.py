@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import numpy as np
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import field
+import perlin
+from tqdm import tqdm
+
+"""
+Runs many simulations without animating them, and collects summary statistics of every run.
+A sweep goes over every combination of the given parameters, and repeats every combination for a number of seeds. The seed determines both the map and the course of the simulation, so a run can be repeated exactly.
+
+Results are stored column by column in a directory, in the same raw format as the history of a simulation (see history.py):
+
+- columns.json      Names and dtypes of the columns.
+- <column>.bin      One entry per run, in the order in which the runs finished.
+- lifespans.bin     Lifespans of all empires that perished, for all runs one after another.
+- peaks.bin         Their largest population sizes.
+- empire_offsets.bin  For every run, the number of entries in the two files above up to and including that run.
+
+An interrupted sweep can be resumed by running it again with the same output; runs that have been stored already are skipped.
+"""
+
+columns = [
+	('real_mode', np.int8), ('size', np.int8), ('granularity', np.int8), ('spawn_rate', np.int8), ('strength', np.int8), ('seed', np.int64), ('iterations', np.int64),
+	('founded', np.int64), #Number of empires founded
+	('perished', np.int64), #Number of empires that perished
+	('lifespan_mean', np.float64), ('lifespan_median', np.float64), ('lifespan_max', np.int64), #Over the empires that perished
+	('peak_mean', np.float64), ('peak_max', np.int64), #Over all empires
+	('living_mean', np.float64), ('living_max', np.int64), ('living_final', np.int64), #Number of empires alive at the same time
+	('occupied_final', np.float64), #Number of blocks that belong to some empire at the end, relative to the number of habitable blocks
+	('seconds', np.float64),
+]
+parameters = ['real_mode', 'size', 'granularity', 'spawn_rate', 'strength', 'seed', 'iterations'] #These identify a run
+
+def run(task):
+	"""Simulate a single run without drawing anything, and return its statistics (one value per column) and the lifespans and peak sizes of the empires that perished."""
+	real_mode, size, granularity, spawn_rate, strength, seed, iterations = task
+	start = time.time()
+	with contextlib.redirect_stdout(io.StringIO()): #Keep the output of hundreds of runs readable
+		input_field = field.Field(real_mode = bool(real_mode), size = size, granularity = granularity, spawn_rate = spawn_rate, strength = strength, seed = seed, engine = 'numpy', recycle_ids = True)
+	empires = input_field.empires
+
+	living = np.zeros(iterations, dtype = np.int64)
+	for i in range(iterations):
+		input_field.iterate()
+		living[i] = len(empires.living)
+
+	archive = empires.archive
+	lifespans = archive.lifespan()
+	peaks = np.concatenate((archive.peak[: len(archive)], empires.peak[empires.living]))
+	statistics = list(task) + [
+		empires.founded - 1, #The empty field counts as an empire too
+		len(archive),
+		lifespans.mean() if len(lifespans) > 0 else np.nan, np.median(lifespans) if len(lifespans) > 0 else np.nan, lifespans.max(initial = 0),
+		peaks.mean() if len(peaks) > 0 else np.nan, peaks.max(initial = 0),
+		living.mean() if iterations > 0 else np.nan, living.max(initial = 0), len(empires.living),
+		(input_field.size**2 - empires.count[0]) / len(input_field.habitable_blocks),
+		time.time() - start,
+	]
+	return statistics, lifespans, archive.peak[: len(archive)]
+
+class ResultsWriter():
+	"""Appends the results of finished runs to the results directory, and knows which runs are in there already."""
+
+	def __init__(self, path):
+		"""Open the results directory, creating it if needed. Whatever a previous sweep wrote only partially gets cut off."""
+		self.path = path
+		os.makedirs(path, exist_ok = True)
+		with open(os.path.join(path, 'columns.json'), 'w') as f:
+			json.dump([[name, np.dtype(dtype).name] for name, dtype in columns], f)
+
+		#A sweep that got interrupted may have written some columns of its last run but not others.
+		lengths = [self.length(name + '.bin', dtype) for name, dtype in columns] + [self.length('empire_offsets.bin', np.int64)]
+		self.runs = min(lengths)
+		offsets = np.fromfile(os.path.join(path, 'empire_offsets.bin'), dtype = np.int64, count = self.runs) if self.runs > 0 else np.zeros(0, dtype = np.int64)
+		self.entries = int(offsets[-1]) if self.runs > 0 else 0
+		for name, dtype in columns:
+			self.truncate(name + '.bin', dtype, self.runs)
+		self.truncate('empire_offsets.bin', np.int64, self.runs)
+		self.truncate('lifespans.bin', np.int64, self.entries)
+		self.truncate('peaks.bin', np.int64, self.entries)
+
+		self.done = set(zip(*[np.fromfile(os.path.join(path, name + '.bin'), dtype = dtype).tolist() for name, dtype in columns if name in parameters])) #Runs that are in there already
+		self.files = {name : open(os.path.join(path, name + '.bin'), 'ab') for name, dtype in columns}
+		for name in ['empire_offsets', 'lifespans', 'peaks']:
+			self.files[name] = open(os.path.join(path, name + '.bin'), 'ab')
+
+	def length(self, name, dtype):
+		path = os.path.join(self.path, name)
+		return os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+
+	def truncate(self, name, dtype, length):
+		with open(os.path.join(self.path, name), 'ab') as f:
+			f.truncate(length * np.dtype(dtype).itemsize)
+
+	def append(self, statistics, lifespans, peaks):
+		"""Store the results of a run, and make sure they are on disk before moving on."""
+		self.entries += len(lifespans)
+		self.files['lifespans'].write(lifespans.astype(np.int64).tobytes())
+		self.files['peaks'].write(peaks.astype(np.int64).tobytes())
+		for (name, dtype), value in zip(columns, statistics):
+			self.files[name].write(np.array([value], dtype = dtype).tobytes())
+		self.files['empire_offsets'].write(np.array([self.entries], dtype = np.int64).tobytes()) #Written last: a run only counts once this is there
+		for f in self.files.values():
+			f.flush()
+		self.runs += 1
+		self.done.add(tuple(statistics[: len(parameters)]))
+
+	def close(self):
+		for f in self.files.values():
+			f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def load(path):
+	"""Read back the results of a sweep as a dictionary of columns. The lifespans and peak sizes of the perished empires of run i are lifespans[offsets[i] : offsets[i + 1]]."""
+	with open(os.path.join(path, 'columns.json'), 'r') as f:
+		names = json.load(f)
+	runs = min(os.path.getsize(os.path.join(path, name + '.bin')) // np.dtype(dtype).itemsize for name, dtype in names + [['empire_offsets', 'int64']])
+	results = {name : np.fromfile(os.path.join(path, name + '.bin'), dtype = dtype, count = runs) for name, dtype in names}
+	results['offsets'] = np.concatenate(([0], np.fromfile(os.path.join(path, 'empire_offsets.bin'), dtype = np.int64, count = runs)))
+	results['lifespans'] = np.fromfile(os.path.join(path, 'lifespans.bin'), dtype = np.int64, count = results['offsets'][-1])
+	results['peaks'] = np.fromfile(os.path.join(path, 'peaks.bin'), dtype = np.int64, count = results['offsets'][-1])
+	return results
+
+def sweep(output, iterations, seeds, real_mode = (True, False), size = (0, 1), granularity = (0, 1, 2, 3), spawn_rate = (0, 1, 2, 3), strength = (0, 1, 2, 3), workers = None):
+	"""
+	Run every combination of the given parameters once for every seed, spread over a pool of worker processes, and store the results in the directory output.
+	Granularity only matters on a map, so blank fields are run with a single granularity.
+	"""
+	if workers is None:
+		workers = os.cpu_count()
+	tasks = []
+	for mode, s, g, rate, st, seed in itertools.product(real_mode, size, granularity, spawn_rate, strength, seeds):
+		if not mode and g != granularity[0]:
+			continue
+		tasks.append((int(mode), s, g if mode else 0, rate, st, seed, iterations))
+
+	with ResultsWriter(output) as writer:
+		tasks = [task for task in tasks if task not in writer.done]
+		print("%d runs to go, %d done already." %(len(tasks), writer.runs))
+		#Every map is generated once up front, so the workers only have to load it from the cache.
+		for s, g, seed in sorted(set((task[1], task[2], task[5]) for task in tasks if task[0])):
+			perlin.terrain(size = s, granularity = g, seed = seed)
+		tasks.sort(key = lambda task : -task[1]) #Large fields first, so that no single long run is left at the end
+		with multiprocessing.Pool(workers) as pool:
+			for result in tqdm(pool.imap_unordered(run, tasks), total = len(tasks), bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}'):
+				writer.append(*result)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Run many simulations without animating them, and store summary statistics of every run.")
+	parser.add_argument('output', help = "directory holding the results; an existing one is resumed")
+	parser.add_argument('--iterations', type = int, default = 1000)
+	parser.add_argument('--seeds', type = int, default = 10, help = "number of seeds per combination of parameters")
+	parser.add_argument('--real-mode', type = int, nargs = '+', choices = [0, 1], default = [1, 0])
+	parser.add_argument('--size', type = int, nargs = '+', choices = range(4), default = [0, 1])
+	parser.add_argument('--granularity', type = int, nargs = '+', choices = range(4), default = [0, 1, 2, 3])
+	parser.add_argument('--spawn-rate', type = int, nargs = '+', choices = range(4), default = [0, 1, 2, 3])
+	parser.add_argument('--strength', type = int, nargs = '+', choices = range(4), default = [0, 1, 2, 3])
+	parser.add_argument('--workers', type = int, default = None, help = "number of worker processes; all cores by default")
+	args = parser.parse_args()
+	sweep(args.output, args.iterations, range(args.seeds), real_mode = args.real_mode, size = args.size, granularity = args.granularity, spawn_rate = args.spawn_rate, strength = args.strength, workers = args.workers)
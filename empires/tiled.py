@@ -0,0 +1,208 @@
+import numpy as np
+import multiprocessing
+import os
+import field
+
+"""
+A playing field that spreads the work of every iteration over several worker processes, for maps of 4096 x 4096 blocks and larger.
+
+The field is cut into horizontal bands of rows, the tiles, and every worker looks after the frontier of its own tile. The inhabitants live in shared memory, so that a worker reads the one-block halo around its tile straight from its neighbours' rows. The partition and the habitability are shared as well, rather than copied into every worker. An iteration goes as follows.
+
+1. Every worker samples the frontier blocks of its tile, using uniform numbers handed out by the main process.
+2. The main process maybe founds a new empire, exactly as Field does.
+3. Every worker writes its updates into its own tile, and reports how the population counts changed; the main process adds these up.
+4. Once all tiles are updated, every worker compares the halo around its tile with the previous iteration, and refreshes its frontier around whatever changed: its own updates, the new empire, and the updates of its neighbours next to the border.
+5. The main process takes care of deaths, ages, milestones and nerfs, exactly as Field does.
+
+Since the tiles are bands of rows, the frontier blocks of all tiles in order are sorted just like the frontier of a single field, and the uniform numbers are drawn from the field's own generator in that order. A tiled field therefore goes through exactly the same iterations as a Field with the 'numpy' engine and the same seed, no matter how many workers it uses.
+"""
+
+class Tile():
+	"""The part of the field a single worker looks after: the rows start_row, ..., stop_row - 1."""
+
+	def __init__(self, buffer, size, start_row, stop_row, partition, habitability, frontier):
+		"""Initialise attributes. The inhabitants, the partition and the habitability (None on a blank field) are given as shared buffers, and the frontier as one array of flat indices per part."""
+		self.flat = np.frombuffer(buffer, dtype = np.uint32)
+		self.size = size
+		self.start = start_row * size #Flat indices of the tile are start, ..., stop - 1
+		self.stop = stop_row * size
+		self.partition = np.frombuffer(partition, dtype = np.int8)
+		self.habitability = np.frombuffer(habitability, dtype = np.float64) if habitability is not None else None
+		self.offsets = np.array([0, -size - 1, size - 1, -size + 1, size + 1, -size, -1, 1, size], dtype = np.int64) #Same as Field.neighbourhood_offsets()
+		self.frontier = [set(blocks.tolist()) for blocks in frontier]
+		self.halo = np.concatenate((np.arange(self.start - size, self.start), np.arange(self.stop, self.stop + size))) #The rows just above and below the tile
+		self.halo = self.halo[(self.halo >= 0) & (self.halo < size**2)]
+		self.halo_inhabitants = self.flat[self.halo]
+
+	def sample(self, part, r, strength):
+		"""Decide on the new inhabitants of the frontier blocks of the tile in the given part, and return the blocks."""
+		self.index = np.sort(np.fromiter(self.frontier[part], dtype = np.int64, count = len(self.frontier[part])))
+		self.owner = field.draw(self.flat, self.index, self.offsets, strength, self.habitability, r).astype(np.uint32)
+		return self.index
+
+	def apply(self):
+		"""Write the updates into the tile, and return the blocks that changed and how the population counts changed."""
+		old = self.flat[self.index]
+		self.flat[self.index] = self.owner
+		changed = self.index[self.owner != old]
+		length = int(max(self.owner.max(initial = 0), old.max(initial = 0))) + 1
+		return changed, np.bincount(self.owner, minlength = length) - np.bincount(old, minlength = length)
+
+	def refresh(self, changed):
+		"""Update the frontier of the tile around the given blocks and around the halo blocks that changed since the last time."""
+		halo_inhabitants = self.flat[self.halo]
+		changed = np.concatenate((changed, self.halo[halo_inhabitants != self.halo_inhabitants]))
+		self.halo_inhabitants = halo_inhabitants
+		affected, part, mixed = field.frontier_changes(self.flat, self.partition, changed, self.offsets, self.start, self.stop)
+		for i in range(field.slow_factor):
+			in_part = part == i
+			self.frontier[i].update(affected[in_part & mixed].tolist())
+			self.frontier[i].difference_update(affected[in_part & ~mixed].tolist())
+		return [len(blocks) for blocks in self.frontier]
+
+def work(connection, barrier, buffer, size, start_row, stop_row, partition, habitability, frontier):
+	"""Carry out the orders of the main process for a single tile. Runs in a worker process."""
+	tile = Tile(buffer, size, start_row, stop_row, partition, habitability, frontier)
+	while True:
+		order = connection.recv()
+		if order[0] == 'sample':
+			_, part, r, strength = order
+			connection.send(tile.sample(part, r, strength))
+		elif order[0] == 'apply':
+			_, spawned = order
+			changed, counts = tile.apply()
+			barrier.wait() #The halo is only complete once every tile has been updated
+			connection.send((counts, tile.refresh(np.concatenate((changed, spawned)))))
+		elif order[0] == 'frontier':
+			connection.send([np.sort(np.fromiter(blocks, dtype = np.int64, count = len(blocks))) for blocks in tile.frontier])
+		elif order[0] == 'stop':
+			break
+
+class TiledField(field.Field):
+	"""A playing field whose iterations are carried out by several worker processes, each looking after a band of rows; see the top of this file. Takes the same arguments as Field, plus the number of workers."""
+
+	tiled = True
+
+	def __init__(self, *args, workers = None, **kwargs):
+		"""Initialise the field as usual, then hand it over to the workers."""
+		kwargs['engine'] = 'numpy'
+		field.Field.__init__(self, *args, **kwargs)
+		self.start(workers)
+
+	def start(self, workers = None):
+		"""Move the inhabitants, the partition and the habitability into shared memory, and start one worker per tile. Each worker takes over the frontier of its tile."""
+		if workers is None:
+			workers = os.cpu_count()
+		workers = max(1, min(workers, self.size // 8)) #Tiles of a few rows at least
+		self.inhabitants, self.buffer = self.share(self.inhabitants, 'I', np.uint32) #Never gets widened, since empire numbers always fit
+		self.partition, partition = self.share(self.partition, 'b', np.int8)
+		habitability = None
+		if self.real_mode:
+			self.habitability, habitability = self.share(self.habitability, 'd', np.float64)
+
+		bounds = [self.size * i // workers for i in range(workers + 1)]
+		barrier = multiprocessing.Barrier(workers)
+		self.connections = []
+		self.workers = []
+		self.frontier_counts = np.zeros((workers, field.slow_factor), dtype = np.int64) #Size of the frontier of every tile, per part
+		for i in range(workers):
+			start, stop = bounds[i] * self.size, bounds[i + 1] * self.size
+			frontier = [np.fromiter(blocks, dtype = np.int64, count = len(blocks)) for blocks in self.frontier]
+			frontier = [blocks[(blocks >= start) & (blocks < stop)] for blocks in frontier]
+			self.frontier_counts[i] = [len(blocks) for blocks in frontier]
+			connection, worker_connection = multiprocessing.Pipe()
+			worker = multiprocessing.Process(target = work, args = (worker_connection, barrier, self.buffer, self.size, bounds[i], bounds[i + 1], partition, habitability, frontier), daemon = True)
+			worker.start()
+			self.connections.append(connection)
+			self.workers.append(worker)
+		del self.frontier #From now on, the workers keep track of it
+		self.spawned = np.zeros(0, dtype = np.int64)
+
+	def share(self, array, typecode, dtype):
+		"""Copy a size x size array into shared memory. Returns the copy, and the buffer to hand over to the workers."""
+		buffer = multiprocessing.RawArray(typecode, self.size**2)
+		shared = np.frombuffer(buffer, dtype = dtype).reshape(self.size, self.size)
+		shared[:] = array
+		return shared, buffer
+
+	def refresh_frontier(self, changed):
+		"""Called when founding a new empire; the workers refresh their frontier around its blocks later on."""
+		self.spawned = np.concatenate((self.spawned, changed))
+
+	def iterate(self):
+		"""Same as Field.iterate, with the sampling and updating done by the workers."""
+		self.messages = [] #Reset the messages
+		self.time += 1
+		if self.profile is not None:
+			self.profile.start()
+		part = self.time % field.slow_factor #Only probe part of the field
+		self.frontier_size = int(self.frontier_counts[:, part].sum())
+
+		#The uniform numbers for all tiles are drawn at once, so that they come out the same as for an untiled field.
+		r = self.rng.random(self.frontier_size)
+		bounds = np.concatenate(([0], np.cumsum(self.frontier_counts[:, part])))
+		for i, connection in enumerate(self.connections):
+			connection.send(('sample', part, r[bounds[i] : bounds[i + 1]], self.empires.strength))
+		index = np.concatenate([connection.recv() for connection in self.connections])
+		self.lap('sample')
+
+		self.spawned = np.zeros(0, dtype = np.int64)
+		touched, before = self.new_empire(index)
+		self.lap('spawn')
+
+		#The workers update their tiles, and we add up the changes in population.
+		for connection in self.connections:
+			connection.send(('apply', self.spawned))
+		for i, connection in enumerate(self.connections):
+			counts, self.frontier_counts[i] = connection.recv()
+			self.empires.count[: len(counts)] += counts
+		after = self.inhabitants.reshape(-1)[touched]
+		changed = after != before
+		self.update_index = touched[changed]
+		self.update_owner = after[changed]
+		self.lap('update')
+
+		self.bookkeeping()
+		self.lap('bookkeeping')
+		self.empires.nerf()
+		self.lap('nerf')
+		if self.profile is not None:
+			self.profile.count(self.frontier_size, len(self.update_index))
+
+	def gather_frontier(self):
+		"""Collect the frontier from the workers."""
+		for connection in self.connections:
+			connection.send(('frontier',))
+		frontier = [set() for _ in range(field.slow_factor)]
+		for connection in self.connections:
+			for i, blocks in enumerate(connection.recv()):
+				frontier[i].update(blocks.tolist())
+		return frontier
+
+	def save(self, path):
+		"""Write a checkpoint; it can be restored with field.load(), or with load() below to carry on with several workers."""
+		self.frontier = self.gather_frontier()
+		try:
+			field.Field.save(self, path)
+		finally:
+			del self.frontier
+
+	def close(self):
+		"""Stop the workers."""
+		for connection in self.connections:
+			connection.send(('stop',))
+		for worker in self.workers:
+			worker.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def load(path, workers = None):
+	"""Restore a tiled field from a checkpoint."""
+	input_field = field.load(path)
+	input_field.__class__ = TiledField
+	input_field.start(workers)
+	return input_field
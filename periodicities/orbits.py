@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import numpy as np
+import argparse
+import json
+import math
+import multiprocessing
+import os
+from tqdm import tqdm
+
+"""
+Orbit structure of polynomial dynamical systems on the integers mod N, for all starting values at once.
+
+A map x -> f(x) mod N turns the residues mod N into a functional graph: every residue points to its image. Every orbit ends up in a cycle (a stable orbit), possibly after passing through a tail. Instead of following one starting value at a time, as count_stable_orbits and stable_orbit_sizes in the notebook do, we work with the array of all images and find all cycles and tails using array operations.
+
+Polynomials are given by their coefficients, highest degree first, like numpy.polyval; so [1, 0, 1] stands for x^2 + 1.
+
+Since f has integer coefficients, f mod N is the product of f mod the prime powers p^k dividing N (Chinese remainder theorem). A cycle of length a mod one factor and a cycle of length b mod another together make gcd(a, b) cycles of length lcm(a, b) mod their product. With crt = True, a sweep therefore only scans the residues mod prime powers, keeps their cycle lengths in a cache file, and puts the cycle lengths for all other N together from those. Prime N still need a full scan, so these dominate the time a large sweep takes: a sweep up to X scans about ln X times fewer residues than scanning every N.
+"""
+
+def images(coefficients, N):
+    """The array of f(x) mod N for x = 0, ..., N - 1, evaluated with Horner's rule so that intermediate values stay below N^2."""
+    if N >= 3037000499:
+        raise ValueError("N = %d is too large; products of residues would not fit in 64 bits." %N)
+    x = np.arange(N, dtype = np.int64)
+    output = np.zeros(N, dtype = np.int64)
+    for coefficient in coefficients:
+        output *= x
+        output += coefficient % N
+        output %= N
+    return output
+
+def cycle_points(images):
+    """Mask of the residues that lie on a cycle. These are the values of f^m for m at least as long as every tail, so we square f until its values stop changing."""
+    on_cycle = np.zeros(len(images), dtype = bool)
+    on_cycle[images] = True
+    ahead = images
+    while True:
+        ahead = ahead[ahead]
+        values = np.zeros(len(images), dtype = bool)
+        values[ahead] = True
+        if values.sum() == on_cycle.sum(): #Then f^m maps its values onto themselves, so they are exactly the cycles
+            return values
+        on_cycle = values
+
+def tail_lengths(images, on_cycle):
+    """Number of steps every residue takes to reach a cycle, by pointer jumping: every round, each residue looks twice as far ahead."""
+    length = (~on_cycle).astype(np.int64)
+    ahead = np.where(on_cycle, np.arange(len(images)), images) #Residues on a cycle stay put, so that their length of 0 is never added again
+    while True:
+        further = length[ahead]
+        if not further.any():
+            return length
+        length += further
+        ahead = ahead[ahead]
+
+def cycle_lengths(images, on_cycle):
+    """Lengths of all cycles, ordered by their smallest residue. Every residue on a cycle gets labelled by the smallest residue on it, using pointer jumping."""
+    points = np.flatnonzero(on_cycle)
+    position = np.zeros(len(images), dtype = np.int64)
+    position[points] = np.arange(len(points))
+    ahead = position[images[points]]
+    label = np.arange(len(points))
+    reach = 1 #Every label is the smallest of this many consecutive points on the cycle
+    while reach < len(points):
+        label = np.minimum(label, label[ahead])
+        ahead = ahead[ahead]
+        reach *= 2
+    roots = label == np.arange(len(points))
+    return np.bincount(label, minlength = len(points))[roots]
+
+def orbit_structure(images, tails = True):
+    """Cycle count, cycle lengths and, unless tails = False, tail lengths of the functional graph given by the array of images."""
+    on_cycle = cycle_points(images)
+    lengths = cycle_lengths(images, on_cycle)
+    output = {'cycles' : len(lengths), 'cycle_lengths' : lengths}
+    if tails:
+        output['tail_lengths'] = tail_lengths(images, on_cycle)
+    return output
+
+def summary(coefficients, N, tails = True):
+    """Orbit structure of f mod N in a form that fits on one line of the output file: cycle lengths and tail lengths are stored as {length : multiplicity}."""
+    structure = orbit_structure(images(coefficients, N), tails = tails)
+    cycle_lengths, cycle_counts = np.unique(structure['cycle_lengths'], return_counts = True)
+    output = {'N' : N, 'cycles' : structure['cycles'], 'cycle_lengths' : {int(length) : int(count) for length, count in zip(cycle_lengths, cycle_counts)}}
+    if tails:
+        tail_counts = np.bincount(structure['tail_lengths'])
+        output['tail_lengths'] = {int(length) : int(count) for length, count in enumerate(tail_counts) if count > 0}
+    return output
+
+def summaries(task):
+    """Summaries for a batch of N. Runs in a worker process."""
+    coefficients, batch, tails = task
+    return [summary(coefficients, N, tails = tails) for N in batch]
+
+def batches(moduli, batch_size):
+    """Split up the moduli into batches of roughly batch_size residues in total, to keep the overhead of the pool low. Large N come first, so that no single long batch is left at the end."""
+    output = []
+    batch = []
+    residues = 0
+    for N in sorted(moduli, reverse = True):
+        batch.append(N)
+        residues += N
+        if residues >= batch_size:
+            output.append(batch)
+            batch = []
+            residues = 0
+    if batch:
+        output.append(batch)
+    return output
+
+def end_line(output):
+    """Make sure that appending to the output file starts on a new line, even if an interruption cut off its last line halfway; read() then skips just that line."""
+    if os.path.exists(output) and os.path.getsize(output) > 0:
+        with open(output, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+def compute(coefficients, moduli, output, tails = True, workers = None, batch_size = 10**6):
+    """Compute the summaries for the given moduli using a pool of worker processes, and append them to the output file as they come in."""
+    end_line(output)
+    with open(output, 'a') as f, multiprocessing.Pool(workers) as pool:
+        tasks = [(coefficients, batch, tails) for batch in batches(moduli, batch_size)]
+        for results in tqdm(pool.imap_unordered(summaries, tasks), total = len(tasks), bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}'):
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+            f.flush()
+
+def read(output):
+    """All summaries in the output file, by N. A line that was cut off halfway by an interruption is ignored."""
+    results = {}
+    if os.path.exists(output):
+        with open(output, 'r') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                for key in ['cycle_lengths', 'tail_lengths']:
+                    if key in result:
+                        result[key] = {int(length) : count for length, count in result[key].items()}
+                results[result['N']] = result
+    return results
+
+def smallest_prime_factors(stop):
+    """Array holding the smallest prime factor of every n < stop, by sieving."""
+    smallest = np.zeros(stop, dtype = np.int64)
+    for p in range(2, math.isqrt(stop - 1) + 1):
+        if smallest[p] == 0:
+            multiples = smallest[p * p :: p]
+            multiples[multiples == 0] = p
+    smallest[smallest == 0] = np.arange(stop)[smallest == 0] #Primes, and 0 and 1
+    return smallest
+
+def prime_powers(N, smallest = None):
+    """The prime powers p^k exactly dividing N, found using the sieve of smallest prime factors if it is given, and by trial division otherwise."""
+    output = []
+    p = 2
+    while N > 1:
+        if smallest is not None:
+            p = int(smallest[N])
+        elif p * p > N:
+            p = N
+        elif N % p != 0:
+            p += 1
+            continue
+        q = 1
+        while N % p == 0:
+            N //= p
+            q *= p
+        output.append(q)
+    return output
+
+def combine(first, second):
+    """Cycle lengths, as {length : multiplicity}, of the product of two maps with the given cycle lengths."""
+    output = {}
+    for a, m in first.items():
+        for b, n in second.items():
+            length = a * b // math.gcd(a, b)
+            output[length] = output.get(length, 0) + m * n * math.gcd(a, b)
+    return output
+
+class Cache():
+    """Cycle lengths of f mod prime powers, kept in a JSON lines file in the same format as the output of a sweep. Without a path, the cache only lives in memory."""
+
+    def __init__(self, coefficients, path = None):
+        self.coefficients = coefficients
+        self.path = path
+        self.cycle_lengths = {N : result['cycle_lengths'] for N, result in read(path).items()} if path is not None else {}
+
+    def fill(self, moduli, workers = None, batch_size = 10**6):
+        """Compute the cycle lengths for the moduli that are not in the cache yet."""
+        missing = set(moduli) - set(self.cycle_lengths)
+        if not missing:
+            return
+        if self.path is None:
+            for N in missing:
+                self.cycle_lengths[N] = summary(self.coefficients, N, tails = False)['cycle_lengths']
+            return
+        print("Scanning %d prime powers." %len(missing))
+        compute(self.coefficients, missing, self.path, tails = False, workers = workers, batch_size = batch_size)
+        self.cycle_lengths.update((N, result['cycle_lengths']) for N, result in read(self.path).items())
+
+    def summary(self, N, smallest = None):
+        """Cycle count and cycle lengths of f mod N, put together from the prime powers dividing N."""
+        factors = prime_powers(N, smallest)
+        self.fill(factors)
+        cycle_lengths = {1 : 1} #The map on a single residue
+        for q in factors:
+            cycle_lengths = combine(cycle_lengths, self.cycle_lengths[q])
+        return {'N' : N, 'cycles' : sum(cycle_lengths.values()), 'cycle_lengths' : dict(sorted(cycle_lengths.items()))}
+
+def cache_file(coefficients):
+    """Default location of the cache of prime powers for the given polynomial."""
+    return 'cache_%s.jsonl' %'_'.join(str(coefficient) for coefficient in coefficients)
+
+def verify(coefficients, stop):
+    """Check that putting together the prime powers gives the same cycle lengths as scanning all residues, for N < stop."""
+    cache = Cache(coefficients)
+    for N in range(1, stop):
+        expected = summary(coefficients, N)
+        result = cache.summary(N)
+        if result['cycles'] != expected['cycles'] or result['cycle_lengths'] != expected['cycle_lengths']:
+            raise AssertionError("Cycle lengths differ for N = %d: %s instead of %s." %(N, result['cycle_lengths'], expected['cycle_lengths']))
+    print("Cycle lengths agree for all N < %d." %stop)
+
+def sweep(coefficients, start, stop, output, workers = None, batch_size = 10**6, crt = False, cache = None):
+    """
+    Compute the orbit structure of f mod N for N = start, ..., stop - 1 using a pool of worker processes, and append the summaries to the output file, one JSON line per N.
+    Values of N that are in the output file already are skipped, so an interrupted sweep can simply be started again.
+    With crt = True, only prime powers are scanned, and their cycle lengths are kept in the cache file (by default cache_file(coefficients)); the summaries then hold the cycle count and cycle lengths, but no tail lengths.
+    """
+    done = set(read(output))
+    moduli = [N for N in range(start, stop) if N not in done]
+    if not crt:
+        compute(coefficients, moduli, output, workers = workers, batch_size = batch_size)
+        return
+
+    cache = Cache(coefficients, cache if cache is not None else cache_file(coefficients))
+    smallest = smallest_prime_factors(stop)
+    cache.fill(set(q for N in moduli for q in prime_powers(N, smallest)), workers = workers, batch_size = batch_size)
+    end_line(output)
+    with open(output, 'a') as f:
+        for i, N in enumerate(tqdm(moduli, bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}')):
+            f.write(json.dumps(cache.summary(N, smallest)) + '\n')
+            if i % 1000 == 999:
+                f.flush()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Cycle counts, cycle lengths and tail lengths of a polynomial map mod N, for a range of N.")
+    parser.add_argument('start', type = int)
+    parser.add_argument('stop', type = int, help = "the last N is stop - 1")
+    parser.add_argument('output', help = "JSON lines file; an existing one is resumed")
+    parser.add_argument('--coefficients', type = int, nargs = '+', default = [1, 0, 1], help = "highest degree first; x^2 + 1 by default")
+    parser.add_argument('--workers', type = int, default = None, help = "all cores by default")
+    parser.add_argument('--crt', action = 'store_true', help = "only scan prime powers, and put the cycle lengths for other N together from those")
+    parser.add_argument('--cache', default = None, help = "cache file of prime powers for --crt")
+    parser.add_argument('--verify', type = int, default = None, metavar = 'STOP', help = "first check --crt against a full scan for all N < STOP")
+    args = parser.parse_args()
+    if args.verify is not None:
+        verify(args.coefficients, args.verify)
+    sweep(args.coefficients, args.start, args.stop, args.output, workers = args.workers, crt = args.crt, cache = args.cache)
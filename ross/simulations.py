@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+import numpy as np
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import statistics
+
+"""
+Some of the models from the notebook, simulated for thousands of replicas at once.
+
+In the notebook, every random number is drawn inside a Python loop, which is easy to follow but slow. Here every model takes the number of replicas and a random generator, and returns one outcome per replica, computed with array operations over all replicas together:
+
+- blood_test           draws the test results of a whole group of people as a single binomial number;
+- branching_process    draws the number of individuals with k children in a generation as a single multinomial draw;
+- markov_chain         advances all chains at once, looking up their next states with a single searchsorted;
+- hitting_time         likewise, until every chain has reached the end state;
+- coupon_collector     draws coupons in chunks for all collectors that are not done yet;
+- hat_matching         generates the permutations of many replicas at once, in chunks.
+
+estimate() runs a model in batches of replicas until the confidence interval around the mean outcome is narrow enough, and simulate() collects a fixed number of outcomes, for instance for a histogram. Both can spread the batches over several worker processes. Every batch gets its own random generator, spawned from a single seed, so the results only depend on the seed and the batch size, and not on the number of workers.
+"""
+
+def blood_test(replicas, rng, infected = 500, healthy = 99500, sensitivity = 0.95, false_positive_rate = 0.01):
+    """Fraction of the people with a positive result who have the disease, in a population of infected and healthy people."""
+    true_positives = rng.binomial(infected, sensitivity, size = replicas)
+    false_positives = rng.binomial(healthy, false_positive_rate, size = replicas)
+    return true_positives / (true_positives + false_positives)
+
+def branching_process(replicas, rng, offspring = (0.25, 0.25, 0.25, 0.25), max_population = 2000, generations = False):
+    """
+    Whether a population that starts with a single individual goes extinct (1) or not (0), where offspring[k] is the probability that an individual has k children. A population that reaches max_population is taken to survive indefinitely.
+    With generations = True, returns the number of generations the population lasted instead, counting the first.
+    """
+    offspring = np.asarray(offspring, dtype = np.float64)
+    offspring = offspring / offspring.sum()
+    population = np.ones(replicas, dtype = np.int64)
+    lasted = np.ones(replicas, dtype = np.int64)
+    active = np.arange(replicas)
+    while len(active) > 0:
+        children = rng.multinomial(population[active], offspring) @ np.arange(len(offspring)) #Number of individuals with 0, 1, 2, ... children, times that number
+        population[active] = children
+        lasted[active] += 1
+        active = active[(children > 0) & (children < max_population)]
+    if generations:
+        return lasted
+    return (population == 0).astype(np.float64)
+
+def cumulative_rows(P):
+    """The rows of the transition matrix P, normalised and summed up cumulatively, and shifted up by their index, so that all rows together form a single sorted array; see step()."""
+    P = np.asarray(P, dtype = np.float64)
+    cumulative = np.cumsum(P / P.sum(axis = 1)[:, None], axis = 1)
+    cumulative[:, -1] = 1 #Against rounding errors
+    return (cumulative + np.arange(len(P))[:, None]).reshape(-1)
+
+def step(states, shifted, rng):
+    """
+    Advance chains in the given states by one step. Just like step(cumulative) in the notebook, a chain in state i moves to the number of entries of row i of the cumulative transition matrix that are at most a uniform number u.
+    Since row i of shifted runs from i to i + 1, looking up i + u in all of it counts all entries of the rows before it as well, which we subtract again.
+    """
+    return np.searchsorted(shifted, states + rng.random(len(states)), side = 'right') - states * math.isqrt(len(shifted))
+
+def markov_chain(replicas, rng, P = ((0.7, 0.3), (0.4, 0.6)), start = 0, steps = 3, target = 0):
+    """Whether a Markov chain with transition matrix P, started in start, is in state target after the given number of steps (1) or not (0)."""
+    shifted = cumulative_rows(P)
+    states = np.full(replicas, start, dtype = np.int64)
+    for _ in range(steps):
+        states = step(states, shifted, rng)
+    return (states == target).astype(np.float64)
+
+def hitting_time(replicas, rng, P = ((0.3, 0.1, 0, 0.6), (0.2, 0.2, 0.3, 0.3), (0.1, 0.3, 0.6, 0), (0.2, 0.3, 0.2, 0.3)), start = 0, end = 0, max_steps = 10**6):
+    """Number of steps a Markov chain with transition matrix P, started in start, takes to arrive in end. The first step is always taken, so for start = end this is the time it takes to return. Chains that have not arrived after max_steps get max_steps."""
+    shifted = cumulative_rows(P)
+    times = np.full(replicas, max_steps, dtype = np.int64)
+    states = np.full(replicas, start, dtype = np.int64)
+    active = np.arange(replicas)
+    for t in range(1, max_steps + 1):
+        states = step(states, shifted, rng)
+        arrived = states == end
+        times[active[arrived]] = t
+        active, states = active[~arrived], states[~arrived]
+        if len(active) == 0:
+            break
+    return times
+
+def coupon_collector(replicas, rng, probabilities = (1,) * 5 + (5,) * 10 + (20,) * 35, chunk = None):
+    """
+    Number of coupons drawn until every kind has been collected, where kind i is drawn with a probability proportional to probabilities[i].
+    Every round, chunk coupons are drawn for every collector that is not done yet, and we record the first draw in which every kind showed up. A collector is done once all kinds have shown up, after as many draws as the latest of these.
+    """
+    probabilities = np.asarray(probabilities, dtype = np.float64)
+    cumulative = np.cumsum(probabilities / probabilities.sum())
+    cumulative[-1] = 1
+    m = len(probabilities)
+    if chunk is None:
+        chunk = int(min(max(m, (1 / probabilities.min()) * probabilities.sum()), 10**5)) #Roughly the number of draws it takes to see the rarest kind
+    never = np.iinfo(np.int64).max
+    first = np.full((replicas, m), never, dtype = np.int64) #Draw in which every kind showed up first
+    output = np.zeros(replicas, dtype = np.int64)
+    active = np.arange(replicas)
+    drawn = 0
+    while len(active) > 0:
+        draws = np.searchsorted(cumulative, rng.random((len(active), chunk)), side = 'right')
+        seen = first[active]
+        np.minimum.at(seen.reshape(-1), (np.arange(len(active))[:, None] * m + draws).reshape(-1), np.broadcast_to(drawn + 1 + np.arange(chunk), draws.shape).reshape(-1))
+        first[active] = seen
+        done = (seen < never).all(axis = 1)
+        output[active[done]] = seen[done].max(axis = 1)
+        active = active[~done]
+        drawn += chunk
+    return output
+
+def hat_matching(replicas, rng, n = 1000, chunk = None):
+    """
+    Number of people who get their own hat back when n hats are handed out at random.
+    The permutations are generated for chunk replicas at a time, so that only a chunk x n array of hats is in memory.
+    """
+    if chunk is None:
+        chunk = max(1, 10**7 // n) #About 80 MB of hats
+    output = np.zeros(replicas, dtype = np.int64)
+    for start in range(0, replicas, chunk):
+        size = min(chunk, replicas - start)
+        hats = rng.permuted(np.tile(np.arange(n), (size, 1)), axis = 1)
+        output[start : start + size] = (hats == np.arange(n)).sum(axis = 1)
+    return output
+
+models = {model.__name__ : model for model in [blood_test, branching_process, markov_chain, hitting_time, coupon_collector, hat_matching]}
+
+def run(task):
+    """Outcomes of a batch of replicas of a model. Runs in a worker process."""
+    model, parameters, replicas, seed = task
+    return models[model](replicas, np.random.default_rng(seed), **parameters)
+
+def batches(model, parameters, batch_size, seed = None, workers = 1):
+    """Outcomes of batch after batch of replicas, in order. With several workers, a few batches are always under way, so that the workers never have to wait."""
+    seeds = np.random.SeedSequence(seed)
+    if workers == 1:
+        while True:
+            yield run((model, parameters, batch_size, seeds.spawn(1)[0]))
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque(pool.apply_async(run, ((model, parameters, batch_size, seed),)) for seed in seeds.spawn(2 * workers))
+        while True:
+            outcomes = pending.popleft().get()
+            pending.append(pool.apply_async(run, ((model, parameters, batch_size, seeds.spawn(1)[0]),)))
+            yield outcomes
+
+def estimate(model, tolerance, confidence = 0.95, batch_size = 10**4, max_replicas = 10**8, seed = None, workers = 1, **parameters):
+    """
+    Mean outcome of the model with the given parameters, along with the half-width of the confidence interval around it and the number of replicas it took.
+    Batches of replicas are run until the half-width drops below tolerance, or until max_replicas have been run. The mean and variance of all batches are combined as they come in.
+    """
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    count, mean, squares = 0, 0.0, 0.0 #Number of outcomes, their mean, and the sum of their squared deviations from it
+    for outcomes in batches(model, parameters, batch_size, seed = seed, workers = workers):
+        outcomes = np.asarray(outcomes, dtype = np.float64)
+        batch_mean = outcomes.mean()
+        delta = batch_mean - mean
+        total = count + len(outcomes)
+        mean += delta * len(outcomes) / total
+        squares += ((outcomes - batch_mean)**2).sum() + delta**2 * count * len(outcomes) / total
+        count = total
+        half_width = z * math.sqrt(squares / (count - 1) / count) if count > 1 else math.inf
+        if half_width < tolerance or count >= max_replicas:
+            break
+    return {'mean' : mean, 'half_width' : half_width, 'replicas' : count}
+
+def simulate(model, replicas, batch_size = 10**4, seed = None, workers = 1, **parameters):
+    """Outcomes of the given number of replicas of the model with the given parameters."""
+    output = []
+    count = 0
+    for outcomes in batches(model, parameters, batch_size, seed = seed, workers = workers):
+        output.append(outcomes[: replicas - count])
+        count += len(output[-1])
+        if count >= replicas:
+            break
+    return np.concatenate(output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Estimate the mean outcome of one of the models to within a given tolerance.")
+    parser.add_argument('model', choices = sorted(models))
+    parser.add_argument('--tolerance', type = float, default = 0.01, help = "half-width of the confidence interval")
+    parser.add_argument('--confidence', type = float, default = 0.95)
+    parser.add_argument('--parameters', type = json.loads, default = {}, help = "keyword arguments of the model as JSON, e.g. '{\"n\": 100}'")
+    parser.add_argument('--batch-size', type = int, default = 10**4)
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = 1)
+    args = parser.parse_args()
+    result = estimate(args.model, args.tolerance, confidence = args.confidence, batch_size = args.batch_size, seed = args.seed, workers = args.workers, **args.parameters)
+    print("%s: %.6f ± %.6f (%d replicas)" %(args.model, result['mean'], result['half_width'], result['replicas']))